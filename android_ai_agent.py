@@ -2,26 +2,30 @@ import asyncio
 import os
 import subprocess
 import time
-import json
-import glob
 import base64
 import re
-from PIL import Image
+import shlex
+import struct
+import threading
+from collections import OrderedDict, deque
+from PIL import Image, features
 from io import BytesIO
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from console_input import ainput as _ainput
+from json_response import parse_json_response as _parse_json_response
+from scrcpy_output import wait_for_scrcpy
 import xml.etree.ElementTree as ET
 import hashlib
-import requests
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.action_chains import ActionChains
-from appium.options.android import UiAutomator2Options
-from appium.webdriver.common.appiumby import AppiumBy
 
 # Try to import Appium dependencies
 try:
     from appium import webdriver
+    from appium.options.android import UiAutomator2Options
+    from appium.webdriver.common.appiumby import AppiumBy
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     APPIUM_AVAILABLE = True
     print("Appium Python client successfully imported.")
 except ImportError as e:
@@ -30,6 +34,340 @@ except ImportError as e:
     print(f"Error: {e}")
     print("To install: pip install Appium-Python-Client")
 
+# Image.Resampling only exists in Pillow >= 9.1 (Pillow-SIMD releases predate it)
+_Resampling = getattr(Image, "Resampling", Image)
+
+# pyvips (with libvips installed) makes the screenshot downscale much cheaper; Pillow is the fallback
+try:
+    import pyvips
+    PYVIPS_AVAILABLE = True
+except (ImportError, OSError):  # OSError: the binding is installed but libvips itself isn't
+    PYVIPS_AVAILABLE = False
+
+# pybase64 has SIMD encoders that are several times faster than the stdlib for screenshot payloads
+try:
+    import pybase64
+    
+    def _data_url(mime_type, data):
+        # b64encode_as_string returns str directly, so there's no separate decode step
+        return f"data:{mime_type};base64,{pybase64.b64encode_as_string(data)}"
+except ImportError:
+    def _data_url(mime_type, data):
+        # Decode the (pure ASCII) base64 bytes to str only once, after adding the prefix
+        return (f"data:{mime_type};base64,".encode("ascii") + base64.b64encode(data)).decode("ascii")
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def _raw_screencap_layout(data):
+    """Return (width, height, header size) for raw `screencap` output in a 4-byte RGBA/RGBX format, else None.
+    
+    The header is the width, height and pixel format as little-endian uint32s, plus a color space
+    word on Android 9+, so its size is whatever precedes the width * height * 4 pixel bytes.
+    """
+    if len(data) < 12 or data.startswith(_PNG_SIGNATURE):
+        return None
+    width, height, pixel_format = struct.unpack_from("<III", data)
+    header_size = len(data) - width * height * 4
+    if pixel_format in (1, 2) and header_size in (12, 16):  # RGBA_8888, RGBX_8888
+        return width, height, header_size
+    return None
+
+
+def _raw_screencap_image(data, layout):
+    """Wrap raw `screencap` pixels in an RGB image (the screen is opaque, so alpha is dropped)."""
+    width, height, header_size = layout
+    return Image.frombuffer("RGB", (width, height), memoryview(data)[header_size:], "raw", "RGBX", 0, 1)
+
+
+# Largest (width, height) a screenshot is sent to the vision model at
+_VISION_MAX_SIZE = (768, 1024)
+
+# Pillow can be built without libwebp; fall back to JPEG for vision payloads then
+WEBP_AVAILABLE = features.check("webp")
+
+# HTTP/2 support in httpx needs the optional h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Printed after each command sent to the persistent adb shell to mark the end of its output
+_ADB_SHELL_SENTINEL = b"__ANDROID_AGENT_END_" + os.urandom(8).hex().encode() + b"__"
+_ADB_SHELL_SEPARATOR = b"\n" + _ADB_SHELL_SENTINEL + b"\n"
+
+# Screenshot digests only need to spot identical frames; xxh3 is much faster than md5 if available
+try:
+    import xxhash
+    _frame_digest = xxhash.xxh3_64_digest
+except ImportError:
+    def _frame_digest(data):
+        return hashlib.md5(data).digest()
+
+# Parses UI hierarchy bounds like "[0,210][1080,399]"
+_BOUNDS_RE = re.compile(r'\[(\d+),(\d+)\]\[(\d+),(\d+)\]')
+
+# Package names of common apps, keyed by casefolded app name
+APP_PACKAGES = {
+    "twitter": "com.twitter.android",
+    "x": "com.twitter.android",
+    "gmail": "com.google.android.gm",
+    "chrome": "com.android.chrome",
+    "youtube": "com.google.android.youtube",
+    "maps": "com.google.android.apps.maps",
+    "settings": "com.android.settings",
+    "camera": "com.android.camera",
+    "photos": "com.google.android.apps.photos",
+    "messages": "com.android.messaging",
+    "phone": "com.android.dialer",
+    "calendar": "com.google.android.calendar",
+    "clock": "com.google.android.deskclock",
+    "play store": "com.android.vending",
+    "whatsapp": "com.whatsapp",
+    "instagram": "com.instagram.android",
+    "facebook": "com.facebook.katana"
+}
+
+# Package name segments shared by too many packages to identify an app
+_GENERIC_PACKAGE_SEGMENTS = frozenset(("com", "org", "net", "io", "android", "google", "apps", "app"))
+
+# Single-step tasks that can be carried out without asking the LLM
+_DIRECT_KEY_TASKS = {
+    "back": "press_back",
+    "go back": "press_back",
+    "press back": "press_back",
+    "home": "go_home",
+    "go home": "go_home",
+    "go to home screen": "go_home",
+    "press home": "go_home",
+    "press enter": "press_enter"
+}
+# Actions that are a single key press: action name -> (message, keycode)
+_KEYEVENT_ACTIONS = {
+    "go_home": ("🏠 Going to home screen", "KEYCODE_HOME"),
+    "home": ("🏠 Going to home screen", "KEYCODE_HOME"),
+    "press_back": ("⬅️ Pressing back button", "KEYCODE_BACK"),
+    "back": ("⬅️ Pressing back button", "KEYCODE_BACK"),
+    "press_enter": ("⌨️ Pressing Enter key", "KEYCODE_ENTER"),
+}
+# Task phrasings that name the app to launch, tried in order
+_APP_LAUNCH_PATTERNS = [
+    re.compile(verb + r"\s+([a-zA-Z0-9\s]+?)(?:\s+and|\s+to|\s+app|\s*$)")
+    for verb in ("open", "launch", "start", "use")
+]
+
+# Words in a task that imply an app, in priority order
+_APP_KEYWORDS = {
+    "twitter": ["twitter", "tweet", "x app"],
+    "gmail": ["gmail", "email", "mail"],
+    "chrome": ["chrome", "browser", "web"],
+    "youtube": ["youtube", "video"],
+    "maps": ["maps", "directions", "navigate"],
+    "camera": ["camera", "photo", "picture"],
+    "settings": ["settings", "preferences"]
+}
+_APP_KEYWORD_ORDER = list(_APP_KEYWORDS)
+_APP_KEYWORD_TO_APP = {keyword: app for app, keywords in _APP_KEYWORDS.items() for keyword in keywords}
+# Longest keywords first so e.g. "email" isn't matched as "mail"
+_APP_KEYWORD_RE = re.compile("|".join(
+    re.escape(keyword) for keyword in sorted(_APP_KEYWORD_TO_APP, key=len, reverse=True)
+))
+
+
+def _tap_key(action_plan):
+    """Key a tap by the element it targets, or by its rough position."""
+    target = (action_plan.get("element_text") or action_plan.get("element_content_desc")
+              or action_plan.get("element_resource_id"))
+    if target:
+        return ("tap", target)
+    # Taps within 5% of each other count as the same tap
+    try:
+        return ("tap", int(float(action_plan.get("x_percent", 50))) // 5, int(float(action_plan.get("y_percent", 50))) // 5)
+    except (TypeError, ValueError):
+        return ("tap",)
+
+
+def _scroll_key(action_plan):
+    """Key a scroll or swipe by its direction."""
+    return (action_plan.get("action"), action_plan.get("direction", "down"))
+
+
+# Builds the key run_task compares to spot a repeated action, per action type;
+# other actions are keyed by their type alone
+_ACTION_KEY_BUILDERS = {
+    "tap": _tap_key,
+    "type": lambda action_plan: ("type", action_plan.get("text", "")),
+    "scroll": _scroll_key,
+    "swipe": _scroll_key,
+}
+
+# Words at the start of a task that don't say what to do on screen ("please tap search")
+_TASK_STOPWORDS = frozenset(("the", "and", "for", "with", "from", "into", "then", "app", "open", "tap", "click",
+                             "please", "now", "press", "select"))
+
+# Splits lowercased text or resource IDs like "search_button" into words
+_WORD_RE = re.compile(r'[a-z]+')
+
+
+def _elements_match_task(elements, task):
+    """Whether a clickable element's resource ID names the task's action (e.g. "search_button" for "search for cats").
+
+    The action is the task's first word that isn't a filler like "open" or "tap"; sharing some other
+    word (e.g. "message_list" for "send message to bob") isn't enough.
+    """
+    action_word = next(
+        (word for word in _WORD_RE.findall(task.lower()) if len(word) >= 3 and word not in _TASK_STOPWORDS), None
+    )
+    if action_word is None:
+        return False
+    for elem in elements:
+        resource_id = elem.get("resource_id", "")
+        if (elem.get("clickable") and resource_id
+                and action_word in _WORD_RE.findall(resource_id.rpartition("/")[2].lower())):
+            return True
+    return False
+
+# Fields of an action in a reply that isn't valid JSON, e.g. `"action": "tap"` or `x_percent: 50`.
+# Text fields (name in group 1, value in group 2) only take quoted values, so prose like "the text
+# field" isn't read as one; other fields (name in group 3) take a quoted value (group 4) or, after
+# a ':' or '=', a bare one (group 5)
+_ACTION_FIELD_RE = re.compile(
+    r'\b(?:(element_text|element_content_desc|element_resource_id|text)["\'\s:=]+["\']([^"\']+)["\']'
+    r'|(action|x_percent|y_percent|direction|wait_time|is_task_complete)'
+    r'(?:["\'\s:=]+["\']([^"\']*)["\']|["\']?\s*[:=]\s*([\w.]+)))',
+    re.IGNORECASE
+)
+
+# `input text` reads %s as a space and can't type other whitespace, so map all of it in one pass
+_ADB_INPUT_TEXT_TRANS = str.maketrans({" ": "%s", "\t": "%s", "\n": "%s"})
+
+# Words on screen that suggest search results are showing
+_SEARCH_RESULTS_RE = re.compile(r'results|search|found|showing|related')
+
+# The query in a search task, e.g. "search for the weather in Paris" -> "weather in Paris"
+_SEARCH_QUERY_RE = re.compile(r'\bsearch\s+(?:(?:for|about|the|a)\s+)*(.+?)\s*$', re.IGNORECASE)
+
+_DIRECT_TAP_RE = re.compile(
+    r'^(?:tap|click|press|select)\s+(?:on\s+)?(?:the\s+)?["\']?(.+?)["\']?(?:\s+(?:button|icon|tab|option))?$',
+    re.IGNORECASE
+)
+
+# Labels a direct tap won't try: longer than a button label, several steps ("photos and delete them"),
+# or a selection of many items ("all", "every photo") rather than one element
+_DIRECT_TAP_MAX_WORDS = 3
+_NOT_A_TAP_LABEL_RE = re.compile(r'\b(?:and|then)\b|[,;]|^(?:all|every|everything|each)\b', re.IGNORECASE)
+
+# System prompt for determine_action, with specific guidance for Android interactions
+DETERMINE_ACTION_SYSTEM_PROMPT = """You are an AI assistant controlling an Android device.
+Determine the best next action based on the task and screen context.
+
+CRITICAL INSTRUCTIONS:
+- ALWAYS use element-based interactions instead of coordinates
+- For tap actions, ALWAYS include element_text, element_content_desc, or element_resource_id
+- NEVER rely solely on x_percent and y_percent for interactions
+- If you can't find an element by exact text, try partial text matching
+- For scrolling, specify the text you want to scroll to when possible
+
+IMPORTANT GUIDELINES:
+1. Break down complex tasks into individual steps and determine the NEXT SINGLE ACTION to take.
+2. For tap actions, x_percent and y_percent MUST be between 0 and 100.
+3. Be adaptive and try different approaches if the same action is repeated multiple times.
+4. When dealing with menus or options that might not be visible, infer their likely positions based on common Android UI patterns.
+5. For Chrome, the menu button (three dots) is typically in the top-right corner (around 95% x, 5-8% y).
+6. For apps with floating action buttons (like Gmail, Twitter), these are usually in the bottom-right corner.
+7. If you need to open a menu to access certain functionality, explicitly state this in your reasoning.
+8. If a UI element is not visible but likely exists, make an educated guess about its position.
+9. When a task involves multiple steps, focus on completing one step at a time.
+10. If you're unsure about an element's position, try to find similar elements or use common UI patterns.
+11. After typing text, look for a search button, keyboard enter key, or suggestion to tap to complete the search.
+12. If you encounter an error or unexpected screen, try pressing back or going home and starting again.
+13. For search tasks, mark the task as complete only after you've tapped on a search result or pressed enter AND the search results are displayed
+
+ELEMENT-BASED INTERACTIONS:
+- When tapping on a UI element, ALWAYS include the element's text, content_desc, or resource_id if available
+- For tap actions, include element_text, element_content_desc, or element_resource_id in your response
+- This helps the system find the exact element to tap, even if its position changes
+- Example: {"action": "tap", "element_text": "Gmail", "x_percent": 50, "y_percent": 50}
+- The system will first try to find and tap the element by its properties before falling back to coordinates
+
+SEARCH TASK COMPLETION CHECKLIST:
+1. Open the app (e.g., Chrome, YouTube)
+2. Tap on the search bar
+3. Type the search query
+4. Tap on a search suggestion OR press enter/search key
+5. Verify search results are displayed for the correct query
+6. ONLY THEN mark the task as complete
+
+COMMON UI PATTERNS:
+- Menu buttons are typically in the top-right corner (90-98% x, 5-15% y)
+- Back buttons are in the bottom navigation or top-left corner
+- Floating action buttons ("+") are usually in the bottom-right corner (85-95% x, 85-95% y)
+- Navigation drawers open from the left edge (tap hamburger menu or swipe from left edge)
+- Tab bars are at the top or bottom of the screen
+- Settings are usually accessed through a menu or gear icon
+- Search bars are typically at the top of the screen (40-60% x, 5-15% y)
+- Keyboard enter/search keys are usually in the bottom-right of the keyboard
+- Suggestions appear below search bars and can be tapped to complete the search
+
+SPECIFIC APP GUIDANCE:
+- Chrome: 
+  * To open an incognito tab: tap menu (three dots, top-right ~95% x, 8% y), then tap "New Incognito tab" in the menu (~70% x, 20% y)
+  * To search: tap address bar (center-top), type query, tap suggestion or press enter, verify results appear
+  * To navigate tabs: tap tab switcher button (square icon, top-right) then tap desired tab
+  * To refresh: swipe down from top or tap refresh icon near address bar
+
+- Gmail: 
+  * To compose an email: tap floating action button (bottom-right)
+  * To open an email: tap on the email in the list
+  * To reply: tap reply button at the bottom of an open email
+  * To navigate folders: tap the hamburger menu (top-left) then select folder
+
+- Twitter/X: 
+  * To create a tweet: tap floating action button (bottom-right)
+  * To view profile: tap profile icon (usually bottom-right or top-left)
+  * To search: tap search icon (usually bottom navigation) then enter query
+  * To view notifications: tap bell icon (usually in bottom navigation)
+
+- Maps:
+  * To search: tap search bar at top, enter location, tap suggestion or search button
+  * To get directions: tap directions button after selecting a location
+  * To change view: use two fingers to zoom in/out, or tap layers button
+
+- Camera:
+  * To take photo: tap large circular button at bottom
+  * To switch cameras: tap switch camera icon (usually top of screen)
+  * To access gallery: tap small thumbnail of last photo (usually bottom corner)
+
+ERROR RECOVERY STRATEGIES:
+- If a tap doesn't produce expected result: try slightly different coordinates
+- If typing doesn't work: tap the input field first, then try typing
+- If an app seems frozen: try waiting a few seconds, then press back
+- If you can't find a UI element: try scrolling in the most likely direction
+- If completely stuck: go home and restart the task from the beginning
+
+Respond with a JSON object containing:
+- "action": One of ["tap", "type", "scroll", "swipe", "go_home", "press_back", "wait", "press_enter"]
+- "x_percent", "y_percent": For tap actions (0-100)
+- "element_text", "element_content_desc", "element_resource_id": For tap actions, to help find the element
+- "text": For type actions
+- "direction": For scroll/swipe actions
+- "wait_time": For wait actions
+- "is_task_complete": Boolean (only true when the ENTIRE task is complete)
+- "reasoning": Your reasoning for this action, including any UI patterns you're using"""
+
+# The system message is the same for every call; only the user message is built per call
+DETERMINE_ACTION_SYSTEM_MESSAGE = {"role": "system", "content": DETERMINE_ACTION_SYSTEM_PROMPT}
+
+# Prompt for the vision model when the UI hierarchy doesn't provide enough text
+SCREEN_TEXT_PROMPT = "Extract all visible text from this Android screen."
+
+# Planning models that accept images (matched by prefix), so screenshots can skip the separate vision call
+MULTIMODAL_MODEL_PREFIXES = (
+    "gpt-4o", "gpt-4.1", "gpt-4-turbo", "gpt-5",
+    "openai/gpt-4o", "openai/gpt-4.1", "anthropic/claude-3", "google/gemini",
+)
+
 # Load environment variables
 load_dotenv()
 
@@ -37,34 +375,117 @@ class AndroidAgent:
     def __init__(self, llm_provider="openai"):
         """Initialize the Android Agent with specified LLM provider."""
         self.adb_path = "adb"
+        # Long-lived `adb shell` processes used for frequent device commands, by channel: "main"
+        # for commands, "capture" for screenshots prefetched while main is busy with something else
+        self.adb_shells = {}
+        self.adb_shell_locks = {"main": asyncio.Lock(), "capture": asyncio.Lock()}
+        self.adb_shell_failures = {"main": 0, "capture": 0}  # Stop using a channel's shell if it keeps failing
+        self.installed_packages = None  # Cached `pm list packages` output as (casefolded, original) pairs
+        self.installed_packages_time = 0
+        self.installed_packages_ttl = 600  # Seconds before the package list is fetched again
+        self.installed_package_segments = {}  # Casefolded package name segment -> first package that has it
         self.scrcpy_process = None
+        self.scrcpy_drain_task = None
         self.screenshot_dir = "screenshots"
+        self.save_screenshots = os.environ.get("SAVE_SCREENSHOTS", "").lower() in ("1", "true", "yes")
+        self.save_hierarchies = os.environ.get("SAVE_HIERARCHIES", "").lower() in ("1", "true", "yes")
         self.llm_provider = llm_provider
-        self.ui_state_cache = {}
+        self.ui_state_cache = OrderedDict()  # Screenshot dHash -> screen text from the vision model
+        self.ui_state_cache_size = 32
+        self.ui_state_max_distance = 4  # Hashes this many bits apart are treated as the same screen
+        self.allow_similar_screens = True  # Cleared after taps/typing, which can change only a few pixels
+        self.encoded_image_cache = OrderedDict()  # Screenshot bytes digest -> (dHash, (image parts, close-up note))
+        self.encoded_image_cache_size = 8
+        # Lossy quality for screenshots sent to the model; UI text stays legible well below the usual 80-90
+        self.image_quality = int(os.environ.get("AGENT_IMAGE_QUALITY", "70"))
+        # Raw screencap frames skip PNG compression on the device and decoding here, at the cost of
+        # moving ~4 bytes per pixel; adb over Wi-Fi may be faster with it turned off
+        self.raw_screencap = os.environ.get("AGENT_RAW_SCREENCAP", "1").lower() in ("1", "true", "yes")
+        self.encode_buffers = threading.local()  # One reusable BytesIO per thread encoding images
+        self.background_tasks = set()  # Fire-and-forget tasks (kept referenced until they finish)
+        self.prefetch_screenshot = False  # Whether the last screen needed a screenshot
+        self.settled_screen = None  # (loop time, frame bytes) of the frame _wait_for_stable_screen settled on
+        self.settled_screen_max_age = 0.5  # Seconds a settled frame stands in for a fresh capture
+        self.early_decode = None  # (frame digest, task) decoding the settled frame ahead of _hash_screenshot
+        self.screen_size = None  # (width, height) from Appium or `wm size`, fetched on first use
         
         # Initialize Appium if available
         self.appium_driver = None
+        self.device_udid = None  # Serial of the connected device, looked up on first use
         if APPIUM_AVAILABLE:
             self._init_appium()
         
+        # One pooled HTTP client for all LLM calls, so connections (and TLS sessions)
+        # are kept alive between steps instead of being set up per request
+        self.http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            timeout=httpx.Timeout(120.0, connect=10.0)
+        )
+        
         # Initialize the LLM client based on provider
         if llm_provider == "openai":
-            self.openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+            self.openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=self.http_client)
             self.vision_model = os.environ.get("OPENAI_MODEL_1", "gpt-4o")
             self.planning_model = os.environ.get("OPENAI_MODEL_2", "gpt-4-turbo")
             print(f"Using OpenAI with models: {self.vision_model}, {self.planning_model}")
         else:  # openrouter
-            self.openai_client = OpenAI(
+            self.openai_client = AsyncOpenAI(
                 api_key=os.environ.get("OPENROUTER_API_KEY"),
-                base_url="https://openrouter.ai/api/v1"
+                base_url="https://openrouter.ai/api/v1",
+                http_client=self.http_client
             )
             self.vision_model = os.environ.get("OPENROUTER_MODEL_1", "anthropic/claude-3-opus-20240229")
             self.planning_model = os.environ.get("OPENROUTER_MODEL_2", "meta-llama/llama-3-70b-instruct")
             print(f"Using OpenRouter with models: {self.vision_model}, {self.planning_model}")
         
+        # When the planning model accepts images, screenshots go straight to it in one call
+        self.single_shot_vision = self.planning_model.startswith(MULTIMODAL_MODEL_PREFIXES)
+        
+        # Request settings that don't change between calls. The output caps are sized to what the
+        # calls actually return (a screen description, a single JSON action) with some headroom
+        self.vision_kwargs = {
+            "model": self.vision_model,
+            "max_tokens": int(os.environ.get("AGENT_VISION_MAX_TOKENS", "500"))
+        }
+        self.planning_kwargs = {
+            "model": self.planning_model,
+            "max_tokens": int(os.environ.get("AGENT_PLANNING_MAX_TOKENS", "500"))
+        }
+        if llm_provider == "openai":
+            # OpenRouter models don't all support JSON mode
+            self.planning_kwargs["response_format"] = {"type": "json_object"}
+        
+        # Limit how many LLM requests can be in flight at once (avoids tripping rate limits)
+        self.llm_semaphore = asyncio.Semaphore(int(os.environ.get("AGENT_LLM_CONCURRENCY", "5")))
+        
         # Create necessary directories
-        os.makedirs(self.screenshot_dir, exist_ok=True)
-        os.makedirs("hierarchies", exist_ok=True)
+        os.makedirs(self.screenshot_dir, exist_ok=True)  # Also used by the interactive `screenshot` command
+        if self.save_hierarchies:
+            os.makedirs("hierarchies", exist_ok=True)
+        
+        # Saved files are written to a fixed ring of names that are overwritten in turn, which bounds
+        # disk use without ever listing or deleting old files (the newest file has the latest mtime)
+        self.screenshot_slot = 0
+        self.screenshot_ring_size = 10
+        self.hierarchy_slot = 0
+        self.hierarchy_ring_size = 5
+    
+    def _get_device_udid(self):
+        """Return the first connected device's serial from `adb devices`, asked once per agent.
+        
+        Both Appium connection attempts need it, so falling back to Appium 1.x doesn't spawn adb again.
+        """
+        if self.device_udid is None:
+            self.device_udid = ""
+            try:
+                devices_output = subprocess.check_output([self.adb_path, "devices"]).decode('utf-8')
+                device_lines = devices_output.strip().split('\n')[1:]
+                if device_lines:
+                    self.device_udid = device_lines[0].split('\t')[0]
+            except Exception as e:
+                print(f"Error getting device UDID: {e}")
+        return self.device_udid
     
     def _connect_appium_2(self):
         """Connect to Appium 2.0 server with proper options."""
@@ -87,16 +508,10 @@ class AndroidAgent:
             options.set_capability('autoGrantPermissions', True)
             
             # Get device UDID
-            try:
-                devices_output = subprocess.check_output(["adb", "devices"]).decode('utf-8')
-                device_lines = devices_output.strip().split('\n')[1:]
-                if device_lines:
-                    device_info = device_lines[0].split('\t')
-                    if len(device_info) > 0 and device_info[0]:
-                        options.set_capability('udid', device_info[0])
-                        print(f"Using device UDID: {device_info[0]}")
-            except Exception as e:
-                print(f"Error getting device UDID: {e}")
+            device_udid = self._get_device_udid()
+            if device_udid:
+                options.set_capability('udid', device_udid)
+                print(f"Using device UDID: {device_udid}")
             
             # Connect to Appium server
             self.appium_driver = webdriver.Remote('http://localhost:4723', options=options)
@@ -105,6 +520,7 @@ class AndroidAgent:
             window_size = self.appium_driver.get_window_size()
             self.screen_width = window_size['width']
             self.screen_height = window_size['height']
+            self.screen_size = (self.screen_width, self.screen_height)  # No need to ask `wm size` later
             
             print(f"✅ Connected to Appium 2.0. Screen size: {self.screen_width}x{self.screen_height}")
             return True
@@ -130,16 +546,10 @@ class AndroidAgent:
             }
             
             # Get device UDID
-            try:
-                devices_output = subprocess.check_output(["adb", "devices"]).decode('utf-8')
-                device_lines = devices_output.strip().split('\n')[1:]
-                if device_lines:
-                    device_info = device_lines[0].split('\t')
-                    if len(device_info) > 0 and device_info[0]:
-                        capabilities['udid'] = device_info[0]
-                        print(f"Using device UDID: {device_info[0]}")
-            except Exception as e:
-                print(f"Error getting device UDID: {e}")
+            device_udid = self._get_device_udid()
+            if device_udid:
+                capabilities['udid'] = device_udid
+                print(f"Using device UDID: {device_udid}")
             
             # Connect to Appium server
             self.appium_driver = webdriver.Remote('http://localhost:4723/wd/hub', desired_capabilities=capabilities)
@@ -148,6 +558,7 @@ class AndroidAgent:
             window_size = self.appium_driver.get_window_size()
             self.screen_width = window_size['width']
             self.screen_height = window_size['height']
+            self.screen_size = (self.screen_width, self.screen_height)  # No need to ask `wm size` later
             
             print(f"✅ Connected to Appium 1.x. Screen size: {self.screen_width}x{self.screen_height}")
             return True
@@ -195,30 +606,251 @@ class AndroidAgent:
             self.appium_driver = None
             return False
     
-    def _encode_image(self, image_path):
-        """Encode image to base64 with resizing for API efficiency."""
+    async def _create_chat_completion(self, **kwargs):
+        """Call the chat completions API, bounded by the LLM concurrency limit."""
+        async with self.llm_semaphore:
+            response = await self.openai_client.chat.completions.create(**kwargs)
+        if response.choices and response.choices[0].finish_reason == "length":
+            print(f"⚠️ {kwargs.get('model')} response was cut off at max_tokens={kwargs.get('max_tokens')}")
+        return response
+    
+    async def _stream_json_reply(self, **kwargs):
+        """Stream a chat completion and stop reading once its first top-level JSON object is complete.
+        
+        Returns the reply text received up to that point, so any explanation the model adds after
+        the JSON is never waited for. Replies without JSON are read to the end.
+        """
+        parts = []
+        depth = 0
+        in_string = escaped = False
+        async with self.llm_semaphore:
+            stream = await self.openai_client.chat.completions.create(**kwargs, stream=True)
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    # Track brace depth outside of string literals
+                    for ch in delta:
+                        if in_string:
+                            if escaped:
+                                escaped = False
+                            elif ch == "\\":
+                                escaped = True
+                            elif ch == '"':
+                                in_string = False
+                        elif ch == '"' and depth:
+                            in_string = True
+                        elif ch == "{":
+                            depth += 1
+                        elif ch == "}" and depth:
+                            depth -= 1
+                            if not depth:
+                                return "".join(parts)
+            finally:
+                await stream.close()
+        return "".join(parts)
+    
+    def _load_image(self, image_data):
+        """Open a screenshot (raw or PNG screencap bytes, or a file path) downscaled to the size sent to the vision model."""
+        max_size = _VISION_MAX_SIZE
+        raw_layout = _raw_screencap_layout(image_data) if isinstance(image_data, bytes) else None
+        
+        # libvips decodes and shrinks in one streaming pass, never holding the full-resolution frame
+        if PYVIPS_AVAILABLE:
+            try:
+                if raw_layout:
+                    width, height, header_size = raw_layout
+                    pixels = pyvips.Image.new_from_memory(memoryview(image_data)[header_size:], width, height, 4, "uchar")
+                    thumb = pixels.extract_band(0, n=3).thumbnail_image(max_size[0], height=max_size[1], size="down")
+                elif isinstance(image_data, bytes):
+                    thumb = pyvips.Image.thumbnail_buffer(image_data, max_size[0], height=max_size[1], size="down")
+                else:
+                    thumb = pyvips.Image.thumbnail(image_data, max_size[0], height=max_size[1], size="down")
+                if thumb.hasalpha():
+                    thumb = thumb.flatten()
+                mode = {1: "L", 3: "RGB"}.get(thumb.bands)
+                if mode and thumb.format == "uchar":
+                    return Image.frombuffer(mode, (thumb.width, thumb.height), thumb.write_to_memory(), "raw", mode, 0, 1)
+            except pyvips.Error as e:
+                print(f"Error resizing screenshot with libvips: {e}")
+        
+        if raw_layout:
+            img = _raw_screencap_image(image_data, raw_layout)
+        else:
+            source = BytesIO(image_data) if isinstance(image_data, bytes) else image_data
+            img = Image.open(source)
+        
+        # Downscale in place if too large; thumbnail() keeps the aspect ratio. With
+        # reducing_gap=1.0 it first shrinks by the largest whole factor that stays above
+        # the target (JPEG: decoded at reduced scale via draft(); PNG: a cheap box reduce),
+        # leaving the bilinear pass (SIMD-accelerated under Pillow-SIMD) a small image
+        img.thumbnail(max_size, _Resampling.BILINEAR, reducing_gap=1.0)
+        
+        # Drop the (always opaque) screencap alpha once, on the small image, so the hash,
+        # crops and encoder all work on RGB instead of each converting their own copy
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        return img
+    
+    def _encode_image(self, image_data):
+        """Encode image (a loaded image, screencap bytes or a file path) as a base64 data URL, resized for API efficiency."""
         try:
-            with Image.open(image_path) as img:
-                # Resize if too large
-                width, height = img.size
-                max_size = (768, 1024)
-                if width > max_size[0] or height > max_size[1]:
-                    ratio = min(max_size[0] / width, max_size[1] / height)
-                    new_size = (int(width * ratio), int(height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
-                
-                # Convert to RGB if needed
-                if img.mode == 'RGBA':
-                    img = img.convert('RGB')
-                
-                # Save to BytesIO
-                buffered = BytesIO()
-                img.save(buffered, format="JPEG", quality=85, optimize=True)
-                return base64.b64encode(buffered.getvalue()).decode('utf-8')
+            img = image_data if isinstance(image_data, Image.Image) else self._load_image(image_data)
+            
+            # Convert to RGB if needed (JPEG can't store alpha or palettes)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert('RGB')
+            
+            # Save to this thread's reusable BytesIO, overwriting the last image in place and
+            # truncating after it (truncating to 0 first would free the allocation); WebP is
+            # noticeably smaller than JPEG for flat UI screenshots
+            buffered = getattr(self.encode_buffers, "buffer", None)
+            if buffered is None:
+                buffered = self.encode_buffers.buffer = BytesIO()
+            buffered.seek(0)
+            if WEBP_AVAILABLE:
+                img.save(buffered, format="WEBP", quality=self.image_quality, method=4)
+                mime_type = "image/webp"
+            else:
+                # No optimize=True: its extra Huffman pass costs far more time than the bytes it saves
+                img.save(buffered, format="JPEG", quality=self.image_quality)
+                mime_type = "image/jpeg"
+            buffered.truncate()
+            with buffered.getbuffer() as encoded:
+                return _data_url(mime_type, encoded)
         except Exception as e:
             print(f"Error encoding image: {e}")
-            with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+            if isinstance(image_data, bytes) and image_data.startswith(_PNG_SIGNATURE):
+                return _data_url("image/png", image_data)
+            if isinstance(image_data, (Image.Image, bytes)):
+                raise
+            with open(image_data, "rb") as image_file:
+                return _data_url("image/png", image_file.read())
+    
+    def _crop_unlabeled_elements(self, img, elements, screen_width, screen_height, max_crops=5):
+        """Crop clickable elements that have no text or description out of a (downscaled) screenshot.
+        
+        Returns a list of (element, data URL) pairs for the first max_crops such elements.
+        """
+        scale_x = img.width / screen_width
+        scale_y = img.height / screen_height
+        crops = []
+        for elem in elements:
+            if len(crops) >= max_crops:
+                break
+            if not elem.get("clickable") or elem.get("text") or elem.get("content_desc"):
+                continue
+            bounds_match = _BOUNDS_RE.match(elem.get("bounds", ""))
+            if not bounds_match:
+                continue
+            x1, y1, x2, y2 = map(int, bounds_match.groups())
+            box = (int(x1 * scale_x), int(y1 * scale_y), int(x2 * scale_x), int(y2 * scale_y))
+            # Skip degenerate boxes and containers that cover most of the screen
+            if box[2] - box[0] < 8 or box[3] - box[1] < 8 or (x2 - x1) * (y2 - y1) > screen_width * screen_height / 4:
+                continue
+            crops.append((elem, self._encode_image(img.crop(box))))
+        return crops
+    
+    def _passthrough_image(self, screenshot):
+        """Return a data URL of screenshot bytes that are already JPEG/WebP within _VISION_MAX_SIZE, else None.
+        
+        Such images (e.g. saved screenshots read back from disk) are sent as they are instead of
+        being re-encoded at the same size.
+        """
+        if not isinstance(screenshot, bytes):
+            return None
+        if screenshot.startswith(b"\xff\xd8\xff"):
+            mime_type = "image/jpeg"
+        elif screenshot[:4] == b"RIFF" and screenshot[8:12] == b"WEBP":
+            mime_type = "image/webp"
+        else:
+            return None
+        try:
+            # Image.open only reads the header here; the pixels are never decoded
+            width, height = Image.open(BytesIO(screenshot)).size
+        except Exception:
+            return None
+        if width <= _VISION_MAX_SIZE[0] and height <= _VISION_MAX_SIZE[1]:
+            return _data_url(mime_type, screenshot)
+        return None
+    
+    def _build_vision_content(self, screenshot, image, elements, screen_width, screen_height):
+        """Encode a screenshot for a vision request, encoding each image exactly once.
+        
+        Returns (image content parts, note describing any close-up images).
+        """
+        image_url = self._passthrough_image(screenshot)
+        if image_url is None:
+            image_url = self._encode_image(image if image is not None else screenshot)
+        image_parts = [{"type": "image_url", "image_url": {"url": image_url}}]
+        crop_note = ""
+        
+        # The hierarchy found elements but none are labeled (icon-only UI): send close-ups of
+        # the unlabeled buttons along with the full screen so one call can identify them
+        if elements and image is not None:
+            try:
+                crops = self._crop_unlabeled_elements(image, elements, screen_width, screen_height)
+            except Exception as e:
+                print(f"Error cropping unlabeled elements: {e}")
+                crops = []
+            
+            if crops:
+                crop_lines = [
+                    f"Image {i + 2}: element at ({elem.get('center_x_percent', '?')}%, {elem.get('center_y_percent', '?')}%)"
+                    for i, (elem, _) in enumerate(crops)
+                ]
+                crop_note = (
+                    "The first image is the full screen; the others are close-ups of unlabeled buttons:\n"
+                    + "\n".join(crop_lines)
+                )
+                image_parts.extend({"type": "image_url", "image_url": {"url": crop_url}} for _, crop_url in crops)
+        
+        return image_parts, crop_note
+    
+    def _find_similar_screen(self, screen_hash):
+        """Return the cached dHash matching this screen (exactly, or within a few bits), or None."""
+        if screen_hash is None:
+            return None
+        if screen_hash in self.ui_state_cache:
+            return screen_hash
+        
+        # A spinner or clock ticking flips a few bits; after a tap or typing those few bits
+        # may be exactly what changed, so only exact matches count then
+        if not self.allow_similar_screens:
+            return None
+        best_hash, best_distance = None, self.ui_state_max_distance + 1
+        for cached_hash in self.ui_state_cache:
+            distance = bin(screen_hash ^ cached_hash).count("1")
+            if distance < best_distance:
+                best_hash, best_distance = cached_hash, distance
+        return best_hash
+    
+    def _remember(self, cache, key, value, max_size):
+        """Store a value in an LRU cache (an OrderedDict), evicting the oldest entries beyond max_size."""
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+    
+    def _compute_dhash(self, img):
+        """Compute a 64-bit difference hash of a screenshot to recognize screens we've already analyzed."""
+        try:
+            # Shrink to 9x8 grayscale and compare each pixel with its right neighbour
+            pixels = list(img.convert('L').resize((9, 8), _Resampling.BOX).getdata())
+            screen_hash = 0
+            for row in range(8):
+                for col in range(8):
+                    left = pixels[row * 9 + col]
+                    right = pixels[row * 9 + col + 1]
+                    screen_hash = (screen_hash << 1) | (left > right)
+            return screen_hash
+        except Exception as e:
+            print(f"Error computing screenshot hash: {e}")
+            return None
     
     async def start_scrcpy(self):
         """Start scrcpy to record the screen."""
@@ -228,27 +860,110 @@ class AndroidAgent:
             recording_path = f"recordings/recording_{timestamp}.mp4"
             cmd = ["scrcpy", "--no-display", "--record", recording_path, "--max-fps", "15"]
             
-            self.scrcpy_process = subprocess.Popen(cmd)
-            await asyncio.sleep(2)
-            return self.scrcpy_process.poll() is None
+            self.scrcpy_process = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+            )
+            self.scrcpy_drain_task = await wait_for_scrcpy(self.scrcpy_process, timeout=10)
+            if self.scrcpy_drain_task:
+                return True
+            self.stop_scrcpy()
+            return False
         except Exception as e:
             print(f"Failed to start scrcpy: {e}")
             return False
     
     def stop_scrcpy(self):
         """Stop the scrcpy process."""
+        if self.scrcpy_drain_task:
+            self.scrcpy_drain_task.cancel()
+            self.scrcpy_drain_task = None
         if self.scrcpy_process:
-            self.scrcpy_process.terminate()
+            if self.scrcpy_process.returncode is None:
+                self.scrcpy_process.terminate()
             self.scrcpy_process = None
     
-    async def capture_screen(self):
-        """Capture the current screen using ADB."""
+    async def _run_in_adb_shell(self, command, timeout=10, channel="main"):
+        """Run a command in a persistent adb shell and return its stdout, or None if the shell failed.
+        
+        Reusing one shell saves spawning adb (and setting up its device connection) for every command.
+        Commands on different channels run in different shells, so they don't wait for each other.
+        """
+        if self.adb_shell_failures[channel] >= 3:
+            return None
+        
+        async with self.adb_shell_locks[channel]:
+            try:
+                shell = self.adb_shells.get(channel)
+                if shell is None or shell.returncode is not None:
+                    # `adb shell` rather than `exec-out`, which never forwards stdin to the device. With
+                    # stdin piped adb allocates no pty, so binary output (screenshots) comes back unmangled
+                    shell = self.adb_shells[channel] = await asyncio.create_subprocess_exec(
+                        self.adb_path, "shell",
+                        stdin=asyncio.subprocess.PIPE,
+                        stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.DEVNULL,
+                        limit=64 * 1024 * 1024  # A whole screenshot has to fit in the read buffer
+                    )
+                
+                sentinel = _ADB_SHELL_SENTINEL.decode()
+                shell.stdin.write(f"{{ {command}; }} 2>/dev/null; printf '\\n{sentinel}\\n'\n".encode())
+                await shell.stdin.drain()
+                output = await asyncio.wait_for(shell.stdout.readuntil(_ADB_SHELL_SEPARATOR), timeout)
+                self.adb_shell_failures[channel] = 0
+                return output[:-len(_ADB_SHELL_SEPARATOR)]
+            except Exception as e:
+                print(f"Persistent adb shell failed, falling back to one-off commands: {e}")
+                self.adb_shell_failures[channel] += 1
+                shell = self.adb_shells.get(channel)
+                self._close_adb_shell(channel)
+                if shell is not None:
+                    await shell.wait()  # Reap it, so a replacement doesn't pile up next to a zombie
+                return None
+    
+    async def _adb_shell_command(self, command):
+        """Run a shell command on the device and return its stdout bytes, or None on failure.
+        
+        Uses the persistent adb shell, falling back to a one-off `adb exec-out` if it's unavailable.
+        """
+        output = await self._run_in_adb_shell(command)
+        if output is not None:
+            return output
+        
+        process = await asyncio.create_subprocess_exec(
+            self.adb_path, "exec-out", command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        output, _ = await process.communicate()
+        return output if process.returncode == 0 else None
+    
+    def _close_adb_shell(self, channel=None):
+        """Stop the persistent adb shell on channel (or all of them), if running."""
+        channels = [channel] if channel else list(self.adb_shells)
+        for name in channels:
+            shell = self.adb_shells.pop(name, None)
+            if shell is not None and shell.returncode is None:
+                shell.kill()
+    
+    async def capture_screen_bytes(self, separate_process=False):
+        """Capture the current screen using ADB and return the frame bytes without touching the disk.
+        
+        Frames are raw screencap output (see _raw_screencap_layout) unless AGENT_RAW_SCREENCAP is
+        off or the device's pixel format isn't supported, in which case they're PNG.
+        
+        With separate_process, the capture goes through its own persistent shell instead of the main
+        one, so it can run at the same time as other shell commands.
+        """
+        raw = self.raw_screencap
+        frame = await self._run_in_adb_shell(
+            "screencap" if raw else "screencap -p", channel="capture" if separate_process else "main"
+        )
+        if frame and (_raw_screencap_layout(frame) if raw else frame.startswith(_PNG_SIGNATURE)):
+            return frame
+        
         try:
-            timestamp = int(time.time())
-            screenshot_path = f"{self.screenshot_dir}/screenshot_{timestamp}.png"
-            
             process = await asyncio.create_subprocess_exec(
-                self.adb_path, "exec-out", "screencap", "-p",
+                self.adb_path, "exec-out", "screencap", *(() if raw else ("-p",)),
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE
             )
@@ -258,59 +973,137 @@ class AndroidAgent:
                 print(f"Error capturing screenshot: {stderr.decode()}")
                 return None
             
-            with open(screenshot_path, "wb") as f:
-                f.write(stdout)
+            if raw and not _raw_screencap_layout(stdout):
+                print("⚠️ Unsupported raw screencap format, capturing PNG screenshots instead")
+                self.raw_screencap = False
+                return await self.capture_screen_bytes(separate_process)
             
-            return screenshot_path
+            return stdout
         except Exception as e:
             print(f"Error capturing screenshot: {e}")
             return None
     
+    def _save_screenshot(self, frame, screenshot_path):
+        """Write a screenshot to screenshot_path as PNG and return the path."""
+        raw_layout = _raw_screencap_layout(frame)
+        if raw_layout:
+            # Raw frames only get PNG-encoded for these debug copies
+            _raw_screencap_image(frame, raw_layout).save(screenshot_path, format="PNG")
+            return screenshot_path
+        with open(screenshot_path, "wb") as f:
+            f.write(frame)
+        return screenshot_path
+    
+    async def _wait_for_stable_screen(self, timeout, interval=0.2, stable_frames=2, changed_from=None):
+        """Wait until the screen stops changing, or at most timeout seconds.
+        
+        The screen counts as settled once stable_frames captures in a row match the one before them,
+        so fast transitions don't pay for a fixed sleep. If changed_from is a frame digest, frames
+        matching it don't count, so a screen that hasn't started changing yet isn't taken as settled.
+        The settled frame is kept so the next get_screen_context can use it instead of capturing
+        the same screen again.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        last_digest = None
+        unchanged = 0
+        while loop.time() < deadline:
+            frame = await self.capture_screen_bytes()
+            if not frame:
+                # Can't tell whether the screen has settled; fall back to waiting it out
+                await asyncio.sleep(max(0, deadline - loop.time()))
+                return
+            digest = _frame_digest(frame)
+            if digest == changed_from:
+                pass  # Still the screen from before; the change hasn't shown up yet
+            elif digest == last_digest:
+                unchanged += 1
+                if unchanged >= stable_frames:
+                    self.settled_screen = (loop.time(), frame)
+                    return
+            else:
+                unchanged = 0
+                last_digest = digest
+            await asyncio.sleep(min(interval, max(0, deadline - loop.time())))
+    
+    async def _write_screenshot(self, frame):
+        """Save screenshot bytes from a worker thread so the disk write doesn't block the event loop."""
+        try:
+            loop = asyncio.get_running_loop()
+            screenshot_path = f"{self.screenshot_dir}/screenshot_{self.screenshot_slot}.png"
+            self.screenshot_slot = (self.screenshot_slot + 1) % self.screenshot_ring_size
+            return await loop.run_in_executor(None, self._save_screenshot, frame, screenshot_path)
+        except Exception as e:
+            print(f"Error saving screenshot: {e}")
+            return None
+    
+    async def capture_screen(self):
+        """Capture the current screen using ADB and save it to the screenshots directory.
+        
+        Returns the saved file's path, or None if the capture or the write failed.
+        """
+        frame = await self.capture_screen_bytes()
+        if not frame:
+            return None
+        
+        return await self._write_screenshot(frame)
+    
     async def get_xml_hierarchy(self):
-        """Extract XML view hierarchy using uiautomator."""
+        """Extract XML view hierarchy using uiautomator.
+        
+        Returns the document as UTF-8 bytes, which ElementTree parses without a decoded copy, or None.
+        """
         try:
-            timestamp = int(time.time())
-            xml_path = f"hierarchies/hierarchy_{timestamp}.xml"
-            
-            # Dump hierarchy
-            dump_cmd = [self.adb_path, "shell", "uiautomator", "dump", "/sdcard/window_dump.xml"]
-            dump_process = await asyncio.create_subprocess_exec(*dump_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-            await dump_process.communicate()
-            
-            if dump_process.returncode != 0:
+            # Dump and read back in one adb round-trip instead of dump + pull + reading a local copy
+            dump_cmd = "uiautomator dump /sdcard/window_dump.xml >/dev/null && cat /sdcard/window_dump.xml"
+            output = await self._adb_shell_command(dump_cmd)
+            if output is None:
                 return None
             
-            # Pull the file
-            pull_cmd = [self.adb_path, "pull", "/sdcard/window_dump.xml", xml_path]
-            pull_process = await asyncio.create_subprocess_exec(*pull_cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-            await pull_process.communicate()
-            
-            if pull_process.returncode != 0:
+            # Skip anything printed before the document
+            start = output.find(b"<?xml")
+            if start < 0:
+                start = output.find(b"<hierarchy")
+            if start < 0:
                 return None
+            xml_content = output[start:] if start else output
             
-            with open(xml_path, "r") as f:
-                return f.read()
+            if self.save_hierarchies:
+                save_task = asyncio.create_task(self._write_hierarchy(xml_content))
+                self.background_tasks.add(save_task)
+                save_task.add_done_callback(self.background_tasks.discard)
+            return xml_content
         except Exception as e:
             print(f"Error getting XML hierarchy: {e}")
             return None
     
-    def cleanup_old_files(self):
-        """Remove old files to save space."""
-        # Clean up hierarchies
-        hierarchies = sorted(glob.glob("hierarchies/hierarchy_*.xml"))
-        while len(hierarchies) > 5:
-            os.remove(hierarchies.pop(0))
-        
-        # Clean up screenshots
-        screenshots = sorted(glob.glob(f"{self.screenshot_dir}/screenshot_*.png"))
-        while len(screenshots) > 10:
-            os.remove(screenshots.pop(0))
+    async def _write_hierarchy(self, xml_content):
+        """Save a hierarchy dump for debugging from a worker thread."""
+        xml_path = f"hierarchies/hierarchy_{self.hierarchy_slot}.xml"
+        self.hierarchy_slot = (self.hierarchy_slot + 1) % self.hierarchy_ring_size
+        
+        def write():
+            with open(xml_path, "wb") as f:
+                f.write(xml_content)
+        
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, write)
+        except Exception as e:
+            print(f"Error saving XML hierarchy: {e}")
     
     async def _get_screen_dimensions(self):
-        """Get the screen dimensions of the device."""
+        """Get the screen dimensions of the device (queried once, then cached for the session)."""
+        if self.screen_size is not None:
+            return self.screen_size
         try:
-            dimensions = subprocess.check_output(["adb", "shell", "wm", "size"]).decode('utf-8').strip()
-            width, height = map(int, dimensions.split(': ')[1].split('x'))
+            output = await self._adb_shell_command("wm size")
+            # "Physical size: WxH", plus an "Override size: WxH" line when one is set; the last
+            # line is the size in effect, and int() parses the bytes directly
+            width, _, height = output.rpartition(b":")[2].partition(b"x")
+            width, height = int(width), int(height)
+            # wm size reports the display's natural size, which doesn't change with rotation
+            self.screen_size = (width, height)
             return width, height
         except Exception as e:
             print(f"Error getting screen dimensions: {e}")
@@ -371,26 +1164,60 @@ class AndroidAgent:
             print(f"Error extracting Appium UI elements: {e}")
             return []
     
-    async def get_screen_context(self):
-        """Get screen context using both Appium and XML data for comprehensive UI understanding."""
+    async def get_screen_context(self, task=None):
+        """Get screen context using both Appium and XML data for comprehensive UI understanding.
+        
+        If task is given, screens without text where a clickable element's ID already names the
+        task's action (e.g. a "search_button" for a search task) skip the screenshot analysis.
+        """
         try:
             # Initialize context
             context = {"app_info": {}, "ui_elements": [], "screen_text": ""}
             
-            # Get screen dimensions
-            width, height = await self._get_screen_dimensions()
-            
-            # Get Appium data
-            appium_elements = await self.get_appium_ui_elements()
-            
-            # Get XML hierarchy (always do this as a complementary data source)
-            xml_content = await self.get_xml_hierarchy()
+            # Dump the XML hierarchy (always a complementary data source) while
+            # screen dimensions and Appium elements are being collected, so the
+            # adb round-trips overlap instead of running back to back
+            xml_task = asyncio.create_task(self.get_xml_hierarchy())
+            
+            # A frame captured just now while waiting for the screen to settle is as good as a new one
+            settled_screen = None
+            if self.settled_screen is not None:
+                settled_at, frame = self.settled_screen
+                self.settled_screen = None
+                if asyncio.get_running_loop().time() - settled_at <= self.settled_screen_max_age:
+                    settled_screen = frame
+            
+            # If the last screen needed a screenshot this one probably does too; start decoding the
+            # settled frame in a worker thread, or capturing one over its own adb connection, now
+            # instead of waiting for the hierarchy to come back
+            screenshot_task = None
+            self.early_decode = None
+            if self.prefetch_screenshot and settled_screen is not None:
+                settled_key = _frame_digest(settled_screen)
+                if settled_key not in self.encoded_image_cache:
+                    decode_task = asyncio.create_task(self._decode_frame(settled_screen))
+                    self.background_tasks.add(decode_task)
+                    decode_task.add_done_callback(self.background_tasks.discard)
+                    self.early_decode = (settled_key, decode_task)
+            elif self.prefetch_screenshot:
+                screenshot_task = asyncio.create_task(self.capture_screen_bytes(separate_process=True))
+                self.background_tasks.add(screenshot_task)
+                screenshot_task.add_done_callback(self.background_tasks.discard)
+            (width, height), appium_elements = await asyncio.gather(
+                self._get_screen_dimensions(),
+                self.get_appium_ui_elements()
+            )
+            xml_content = await xml_task
             xml_elements = []
             
             if xml_content:
                 # Parse XML
                 root = ET.fromstring(xml_content)
                 
+                # Pixel -> percent factors, computed once rather than dividing for every element
+                x_percent_scale = 100 / width
+                y_percent_scale = 100 / height
+                
                 # Extract app info if not already set by Appium
                 if not context["app_info"]:
                     context["app_info"] = {
@@ -413,15 +1240,15 @@ class AndroidAgent:
                     
                     # Parse bounds if available
                     if element["bounds"]:
-                        bounds_match = re.match(r'\[(\d+),(\d+)\]\[(\d+),(\d+)\]', element["bounds"])
+                        bounds_match = _BOUNDS_RE.match(element["bounds"])
                         if bounds_match:
                             x1, y1, x2, y2 = map(int, bounds_match.groups())
                             element["center_x"] = (x1 + x2) // 2
                             element["center_y"] = (y1 + y2) // 2
                             
                             # Add percentage coordinates
-                            element["center_x_percent"] = round((element["center_x"] / width) * 100, 1)
-                            element["center_y_percent"] = round((element["center_y"] / height) * 100, 1)
+                            element["center_x_percent"] = round(element["center_x"] * x_percent_scale, 1)
+                            element["center_y_percent"] = round(element["center_y"] * y_percent_scale, 1)
                     
                     # Only add elements with text, content description, or interactivity
                     if (element["text"] or element["content_desc"] or 
@@ -455,90 +1282,181 @@ class AndroidAgent:
             context["screen_text"] = " ".join(text_elements)
             
             # If we still don't have enough info, use screenshot analysis
-            if not context["ui_elements"] or not context["screen_text"]:
-                screenshot_path = await self.capture_screen()
-                if screenshot_path:
-                    # Use vision model to extract text
-                    base64_image = self._encode_image(screenshot_path)
-                    response = self.openai_client.chat.completions.create(
-                        model=self.vision_model,
-                        messages=[
-                            {"role": "user", "content": [
-                                {"type": "text", "text": "Extract all visible text from this Android screen."},
-                                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                            ]}
-                        ],
-                        max_tokens=500
-                    )
-                    context["screen_text"] = response.choices[0].message.content
+            needs_screenshot = not context["ui_elements"] or not context["screen_text"]
+            if needs_screenshot and task and _elements_match_task(context["ui_elements"], task):
+                print("⚡ UI hierarchy has an element matching the task, skipping screenshot analysis")
+                needs_screenshot = False
+            self.prefetch_screenshot = needs_screenshot
+            if needs_screenshot:
+                screenshot = (settled_screen
+                              or (await screenshot_task if screenshot_task else None)
+                              or await self.capture_screen_bytes())
+                if screenshot:
+                    if self.save_screenshots:
+                        # Debug copy only; the analysis below works on the in-memory bytes
+                        save_task = asyncio.create_task(self._write_screenshot(screenshot))
+                        self.background_tasks.add(save_task)
+                        save_task.add_done_callback(self.background_tasks.discard)
+                    
+                    frame_key = context["frame_digest"] = _frame_digest(screenshot)
+                    if self.single_shot_vision:
+                        # The planning model can see: attach the screenshot to its request rather
+                        # than spending a separate vision call on transcribing it first
+                        screen_hash, image = await self._hash_screenshot(screenshot, frame_key)
+                        context["screen_images"] = await self._vision_payload(
+                            screenshot, image, frame_key, screen_hash, context["ui_elements"], width, height
+                        )
+                    else:
+                        context["screen_text"] = await self._extract_screen_text(
+                            screenshot, context["ui_elements"], width, height, frame_key=frame_key
+                        )
             
             return context
         except Exception as e:
             print(f"Error getting screen context: {e}")
             return {"app_info": {}, "ui_elements": [], "screen_text": ""}
     
+    async def _hash_screenshot(self, screenshot, frame_key):
+        """Return (dHash, downscaled image) for a screenshot; frames seen before skip decoding (image is None)."""
+        # An identical frame (e.g. retrying after a failed vision call) reuses its hash
+        if frame_key in self.encoded_image_cache:
+            return self.encoded_image_cache[frame_key][0], None
+        
+        # The frame is decoded and downscaled once, then shared by the hash and the encoder;
+        # get_screen_context may already have started that while the hierarchy was dumped
+        early_decode, self.early_decode = self.early_decode, None
+        if early_decode is not None and early_decode[0] == frame_key:
+            image = await early_decode[1]
+        else:
+            image = await self._decode_frame(screenshot)
+        if image is None:
+            return None, None
+        return self._compute_dhash(image), image
+    
+    async def _decode_frame(self, screenshot):
+        """Decode and downscale a screenshot in a worker thread; returns None if it can't be loaded."""
+        # Decoding, hashing and re-encoding the frame is CPU work; keep it off the event loop
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self._load_image, screenshot)
+        except Exception as e:
+            print(f"Error loading screenshot: {e}")
+            return None
+    
+    async def _vision_payload(self, screenshot, image, frame_key, screen_hash, elements=(), screen_width=0, screen_height=0):
+        """Return the encoded (image parts, close-up note) for a screenshot, reusing it for identical frames."""
+        cached = self.encoded_image_cache.get(frame_key)
+        if cached is not None:
+            payload = cached[1]
+        else:
+            loop = asyncio.get_running_loop()
+            payload = await loop.run_in_executor(
+                None, self._build_vision_content, screenshot, image, elements, screen_width, screen_height
+            )
+        self._remember(self.encoded_image_cache, frame_key, (screen_hash, payload), self.encoded_image_cache_size)
+        return payload
+    
+    async def _extract_screen_text(self, screenshot, elements=(), screen_width=0, screen_height=0, frame_key=None):
+        """Have the vision model read a screenshot (screencap bytes), reusing earlier results for screens we've seen."""
+        if frame_key is None:
+            frame_key = _frame_digest(screenshot)
+        screen_hash, image = await self._hash_screenshot(screenshot, frame_key)
+        
+        # Reuse the vision result if we've already seen this screen
+        cached_hash = self._find_similar_screen(screen_hash)
+        if cached_hash is not None:
+            print("⚡ Using cached screen text for a previously analyzed screen")
+            self.ui_state_cache.move_to_end(cached_hash)
+            return self.ui_state_cache[cached_hash]
+        
+        # Use vision model to extract text
+        image_parts, crop_note = await self._vision_payload(
+            screenshot, image, frame_key, screen_hash, elements, screen_width, screen_height
+        )
+        prompt = SCREEN_TEXT_PROMPT
+        if crop_note:
+            prompt += f" {crop_note}\nAfter the screen text, say in a few words what each button is, using its position."
+        
+        response = await self._create_chat_completion(
+            **self.vision_kwargs,
+            messages=[{"role": "user", "content": [{"type": "text", "text": prompt}] + image_parts}]
+        )
+        screen_text = response.choices[0].message.content
+        
+        if screen_hash is not None:
+            self._remember(self.ui_state_cache, screen_hash, screen_text, self.ui_state_cache_size)
+        return screen_text
+    
+    async def _get_installed_packages(self):
+        """Return (casefolded name, name) pairs for the device's installed packages, cached for a few minutes."""
+        if (self.installed_packages is not None
+                and time.monotonic() - self.installed_packages_time < self.installed_packages_ttl):
+            return self.installed_packages
+        
+        try:
+            output = await self._adb_shell_command("pm list packages")
+            if output is None:
+                return self.installed_packages or []
+            
+            # Keep a casefolded copy of each name next to it so lookups don't re-fold the whole list
+            self.installed_packages = [
+                (package.casefold(), package)
+                for package in (
+                    line[len("package:"):].strip()
+                    for line in output.decode('utf-8', errors='replace').splitlines()
+                    if line.startswith("package:")
+                )
+            ]
+            # Index the dotted segments so an app name like "spotify" finds com.spotify.music
+            # with one lookup; the first package (in pm order) with a segment keeps it
+            segments = {}
+            for folded, package in self.installed_packages:
+                for segment in folded.split("."):
+                    if segment not in _GENERIC_PACKAGE_SEGMENTS:
+                        segments.setdefault(segment, package)
+            self.installed_package_segments = segments
+            self.installed_packages_time = time.monotonic()
+        except Exception as e:
+            print(f"Error listing installed packages: {e}")
+        return self.installed_packages or []
+    
     async def launch_app(self, app_name):
         """Launch an app by name using ADB."""
         print(f"Launching {app_name}...")
         
-        # Common app package mapping
-        app_packages = {
-            "twitter": "com.twitter.android",
-            "x": "com.twitter.android",
-            "gmail": "com.google.android.gm",
-            "chrome": "com.android.chrome",
-            "youtube": "com.google.android.youtube",
-            "maps": "com.google.android.apps.maps",
-            "settings": "com.android.settings",
-            "camera": "com.android.camera",
-            "photos": "com.google.android.apps.photos",
-            "messages": "com.android.messaging",
-            "phone": "com.android.dialer",
-            "calendar": "com.google.android.calendar",
-            "clock": "com.google.android.deskclock",
-            "play store": "com.android.vending",
-            "whatsapp": "com.whatsapp",
-            "instagram": "com.instagram.android",
-            "facebook": "com.facebook.katana"
-        }
-        
-        # Find package name
-        app_name_lower = app_name.lower()
-        package_name = None
-        
-        for name, pkg in app_packages.items():
-            if name in app_name_lower or app_name_lower in name:
-                package_name = pkg
-                break
+        # Find package name: an exact name first, then a partial match against the common apps
+        app_name_key = app_name.casefold().strip()
+        package_name = APP_PACKAGES.get(app_name_key)
+        if not package_name:
+            package_name = next(
+                (pkg for name, pkg in APP_PACKAGES.items() if name in app_name_key or app_name_key in name),
+                None
+            )
         
         if not package_name:
-            try:
-                # Try to find package using grep
-                packages_output = subprocess.check_output(
-                    ["adb", "shell", "pm", "list", "packages", "|", "grep", "-i", app_name_lower]
-                ).decode('utf-8').strip()
-                
-                if packages_output:
-                    package_name = packages_output.split('\n')[0].replace('package:', '')
-                else:
-                    return False
-            except:
+            # Look the app up among the installed packages
+            packages = await self._get_installed_packages()
+            package_name = self.installed_package_segments.get(app_name_key) or next(
+                (pkg for folded, pkg in packages if app_name_key in folded), None
+            )
+            if not package_name:
                 return False
         
         try:
-            # Launch app using monkey
-            launch_cmd = [
-                "adb", "shell", "monkey", 
-                "-p", package_name, 
-                "-c", "android.intent.category.LAUNCHER", 
-                "1"
-            ]
+            # Note the screen before launching, so the launcher isn't mistaken for the app having settled
+            before_launch = await self.capture_screen_bytes()
             
-            result = subprocess.run(launch_cmd, capture_output=True, text=True)
-            success = "Events injected: 1" in result.stdout or "Events injected: 1" in result.stderr
+            # Launch app using monkey
+            output = await self._adb_shell_command(
+                f"monkey -p {shlex.quote(package_name)} -c android.intent.category.LAUNCHER 1 2>&1"
+            )
+            success = output is not None and b"Events injected: 1" in output
             
             if success:
-                await asyncio.sleep(2)  # Wait for app to start
+                # Wait for app to start
+                await self._wait_for_stable_screen(
+                    2.0, changed_from=_frame_digest(before_launch) if before_launch else None
+                )
                 return True
             return False
         except Exception as e:
@@ -550,27 +1468,8 @@ class AndroidAgent:
         task_lower = task.lower()
         
         # Check for explicit app launch patterns
-        app_patterns = [
-            r"open\s+([a-zA-Z0-9\s]+?)(?:\s+and|\s+to|\s+app|\s*$)",
-            r"launch\s+([a-zA-Z0-9\s]+?)(?:\s+and|\s+to|\s+app|\s*$)",
-            r"start\s+([a-zA-Z0-9\s]+?)(?:\s+and|\s+to|\s+app|\s*$)",
-            r"use\s+([a-zA-Z0-9\s]+?)(?:\s+and|\s+to|\s+app|\s*$)"
-        ]
-        
-        # Common app keywords
-        app_keywords = {
-            "twitter": ["twitter", "tweet", "x app"],
-            "gmail": ["gmail", "email", "mail"],
-            "chrome": ["chrome", "browser", "web"],
-            "youtube": ["youtube", "video"],
-            "maps": ["maps", "directions", "navigate"],
-            "camera": ["camera", "photo", "picture"],
-            "settings": ["settings", "preferences"]
-        }
-        
-        # Check patterns
-        for pattern in app_patterns:
-            match = re.search(pattern, task_lower)
+        for pattern in _APP_LAUNCH_PATTERNS:
+            match = pattern.search(task_lower)
             if match:
                 # Extract just the app name, not the entire task
                 app_name = match.group(1).strip()
@@ -578,151 +1477,53 @@ class AndroidAgent:
                 app_name = app_name.split()[0]
                 return {"requires_app": True, "app": app_name}
         
-        # Check keywords
-        for app, keywords in app_keywords.items():
-            if any(keyword in task_lower for keyword in keywords):
-                return {"requires_app": True, "app": app}
+        # Check keywords in one pass; if several apps match, the first listed wins
+        matched = {_APP_KEYWORD_TO_APP[keyword] for keyword in _APP_KEYWORD_RE.findall(task_lower)}
+        if matched:
+            return {"requires_app": True, "app": min(matched, key=_APP_KEYWORD_ORDER.index)}
         
         return {"requires_app": False, "app": None}
     
     async def determine_action(self, task, screen_context):
         """Determine the next action based on task and screen context."""
         try:
-            # Enhance the system prompt with more specific guidance for Android interactions
-            system_prompt = """You are an AI assistant controlling an Android device.
-Determine the best next action based on the task and screen context.
-
-CRITICAL INSTRUCTIONS:
-- ALWAYS use element-based interactions instead of coordinates
-- For tap actions, ALWAYS include element_text, element_content_desc, or element_resource_id
-- NEVER rely solely on x_percent and y_percent for interactions
-- If you can't find an element by exact text, try partial text matching
-- For scrolling, specify the text you want to scroll to when possible
-
-IMPORTANT GUIDELINES:
-1. Break down complex tasks into individual steps and determine the NEXT SINGLE ACTION to take.
-2. For tap actions, x_percent and y_percent MUST be between 0 and 100.
-3. Be adaptive and try different approaches if the same action is repeated multiple times.
-4. When dealing with menus or options that might not be visible, infer their likely positions based on common Android UI patterns.
-5. For Chrome, the menu button (three dots) is typically in the top-right corner (around 95% x, 5-8% y).
-6. For apps with floating action buttons (like Gmail, Twitter), these are usually in the bottom-right corner.
-7. If you need to open a menu to access certain functionality, explicitly state this in your reasoning.
-8. If a UI element is not visible but likely exists, make an educated guess about its position.
-9. When a task involves multiple steps, focus on completing one step at a time.
-10. If you're unsure about an element's position, try to find similar elements or use common UI patterns.
-11. After typing text, look for a search button, keyboard enter key, or suggestion to tap to complete the search.
-12. If you encounter an error or unexpected screen, try pressing back or going home and starting again.
-13. For search tasks, mark the task as complete only after you've tapped on a search result or pressed enter AND the search results are displayed
-
-ELEMENT-BASED INTERACTIONS:
-- When tapping on a UI element, ALWAYS include the element's text, content_desc, or resource_id if available
-- For tap actions, include element_text, element_content_desc, or element_resource_id in your response
-- This helps the system find the exact element to tap, even if its position changes
-- Example: {"action": "tap", "element_text": "Gmail", "x_percent": 50, "y_percent": 50}
-- The system will first try to find and tap the element by its properties before falling back to coordinates
-
-SEARCH TASK COMPLETION CHECKLIST:
-1. Open the app (e.g., Chrome, YouTube)
-2. Tap on the search bar
-3. Type the search query
-4. Tap on a search suggestion OR press enter/search key
-5. Verify search results are displayed for the correct query
-6. ONLY THEN mark the task as complete
-
-COMMON UI PATTERNS:
-- Menu buttons are typically in the top-right corner (90-98% x, 5-15% y)
-- Back buttons are in the bottom navigation or top-left corner
-- Floating action buttons ("+") are usually in the bottom-right corner (85-95% x, 85-95% y)
-- Navigation drawers open from the left edge (tap hamburger menu or swipe from left edge)
-- Tab bars are at the top or bottom of the screen
-- Settings are usually accessed through a menu or gear icon
-- Search bars are typically at the top of the screen (40-60% x, 5-15% y)
-- Keyboard enter/search keys are usually in the bottom-right of the keyboard
-- Suggestions appear below search bars and can be tapped to complete the search
-
-SPECIFIC APP GUIDANCE:
-- Chrome: 
-  * To open an incognito tab: tap menu (three dots, top-right ~95% x, 8% y), then tap "New Incognito tab" in the menu (~70% x, 20% y)
-  * To search: tap address bar (center-top), type query, tap suggestion or press enter, verify results appear
-  * To navigate tabs: tap tab switcher button (square icon, top-right) then tap desired tab
-  * To refresh: swipe down from top or tap refresh icon near address bar
-
-- Gmail: 
-  * To compose an email: tap floating action button (bottom-right)
-  * To open an email: tap on the email in the list
-  * To reply: tap reply button at the bottom of an open email
-  * To navigate folders: tap the hamburger menu (top-left) then select folder
-
-- Twitter/X: 
-  * To create a tweet: tap floating action button (bottom-right)
-  * To view profile: tap profile icon (usually bottom-right or top-left)
-  * To search: tap search icon (usually bottom navigation) then enter query
-  * To view notifications: tap bell icon (usually in bottom navigation)
-
-- Maps:
-  * To search: tap search bar at top, enter location, tap suggestion or search button
-  * To get directions: tap directions button after selecting a location
-  * To change view: use two fingers to zoom in/out, or tap layers button
-
-- Camera:
-  * To take photo: tap large circular button at bottom
-  * To switch cameras: tap switch camera icon (usually top of screen)
-  * To access gallery: tap small thumbnail of last photo (usually bottom corner)
-
-ERROR RECOVERY STRATEGIES:
-- If a tap doesn't produce expected result: try slightly different coordinates
-- If typing doesn't work: tap the input field first, then try typing
-- If an app seems frozen: try waiting a few seconds, then press back
-- If you can't find a UI element: try scrolling in the most likely direction
-- If completely stuck: go home and restart the task from the beginning
-
-Respond with a JSON object containing:
-- "action": One of ["tap", "type", "scroll", "swipe", "go_home", "press_back", "wait", "press_enter"]
-- "x_percent", "y_percent": For tap actions (0-100)
-- "element_text", "element_content_desc", "element_resource_id": For tap actions, to help find the element
-- "text": For type actions
-- "direction": For scroll/swipe actions
-- "wait_time": For wait actions
-- "is_task_complete": Boolean (only true when the ENTIRE task is complete)
-- "reasoning": Your reasoning for this action, including any UI patterns you're using"""
-
-            # Prepare user prompt with enhanced context
-            user_prompt = f"Task: {task}\n\nScreen Context:\n"
+            # Prepare user prompt with enhanced context; the pieces are joined once at the end
+            prompt_parts = [f"Task: {task}\n\nScreen Context:\n"]
             
             # Add app info
             if screen_context["app_info"]:
-                user_prompt += f"App: {screen_context['app_info'].get('app_name', 'Unknown')}\n"
-                user_prompt += f"Package: {screen_context['app_info'].get('package', 'Unknown')}\n"
+                prompt_parts.append(f"App: {screen_context['app_info'].get('app_name', 'Unknown')}\n")
+                prompt_parts.append(f"Package: {screen_context['app_info'].get('package', 'Unknown')}\n")
             
             # Add UI elements (limited to 15)
             if screen_context["ui_elements"]:
-                user_prompt += "UI Elements:\n"
+                prompt_parts.append("UI Elements:\n")
                 for i, elem in enumerate(screen_context["ui_elements"][:15]):
-                    user_prompt += f"Element {i+1}: "
+                    fields = [f"Element {i+1}:"]
                     if elem.get("text"):
-                        user_prompt += f"Text: \"{elem.get('text')}\" "
+                        fields.append(f"Text: \"{elem.get('text')}\"")
                     if elem.get("content_desc"):
-                        user_prompt += f"Desc: \"{elem.get('content_desc')}\" "
+                        fields.append(f"Desc: \"{elem.get('content_desc')}\"")
                     if elem.get("resource_id"):
-                        user_prompt += f"ID: \"{elem.get('resource_id')}\" "
-                    user_prompt += f"Class: {elem.get('class')} "
-                    user_prompt += f"Clickable: {elem.get('clickable')}"
+                        fields.append(f"ID: \"{elem.get('resource_id')}\"")
+                    fields.append(f"Class: {elem.get('class')}")
+                    fields.append(f"Clickable: {elem.get('clickable')}")
                     if "center_x_percent" in elem and "center_y_percent" in elem:
-                        user_prompt += f" Position: ({elem['center_x_percent']}%, {elem['center_y_percent']}%)"
+                        fields.append(f"Position: ({elem['center_x_percent']}%, {elem['center_y_percent']}%)")
                     elif "center_x" in elem and "center_y" in elem:
-                        user_prompt += f" Position: ({elem['center_x']}, {elem['center_y']})"
+                        fields.append(f"Position: ({elem['center_x']}, {elem['center_y']})")
                     if "source" in elem:
-                        user_prompt += f" Source: {elem['source']}"
-                    print()
+                        fields.append(f"Source: {elem['source']}")
+                    prompt_parts.append(" ".join(fields) + "\n")
             
             # Add screen text
             if screen_context["screen_text"]:
-                user_prompt += f"\nScreen Text: {screen_context['screen_text']}\n"
+                prompt_parts.append(f"\nScreen Text: {screen_context['screen_text']}\n")
             
             # Add task-specific context to help the LLM
             task_lower = task.lower()
             if "chrome" in task_lower and ("incognito" in task_lower or "private" in task_lower):
-                user_prompt += """
+                prompt_parts.append("""
 Task Context: Opening an incognito tab in Chrome typically requires:
 1. Finding the Chrome menu button (three dots, usually in the top-right corner)
 2. Tapping the menu button to open the menu
@@ -730,31 +1531,31 @@ Task Context: Opening an incognito tab in Chrome typically requires:
 
 If the menu button is not visible in the UI elements, it's typically located at around 95% x, 5-8% y position.
 The "New Incognito tab" option is usually in the top portion of the menu that appears.
-"""
+""")
             elif "gmail" in task_lower and "compose" in task_lower:
-                user_prompt += """
+                prompt_parts.append("""
 Task Context: Composing an email in Gmail typically requires:
 1. Finding the compose button (usually a floating action button with a plus or pencil icon in the bottom-right)
 2. Tapping the compose button
 3. Filling in the recipient, subject, and body fields
 
 If the compose button is not visible in the UI elements, it's typically located at around 90% x, 90% y position.
-"""
+""")
             elif "twitter" in task_lower and "tweet" in task_lower:
-                user_prompt += """
+                prompt_parts.append("""
 Task Context: Creating a tweet typically requires:
 1. Finding the compose tweet button (usually a floating action button with a plus or feather icon)
 2. Tapping the compose button
 3. Typing the tweet content
 
 If the compose button is not visible in the UI elements, it's typically located at around 90% x, 90% y position.
-"""
+""")
             elif "search" in task_lower:
                 # Extract the search query
-                search_parts = task_lower.split("search")
-                if len(search_parts) > 1:
-                    search_query = search_parts[1].strip()
-                    user_prompt += f"""
+                search_match = _SEARCH_QUERY_RE.search(task_lower)
+                if search_match:
+                    search_query = search_match.group(1)
+                    prompt_parts.append(f"""
 Task Context: Searching for "{search_query}" typically requires:
 1. Tapping on the search bar (usually at the top of the screen)
 2. Typing the search query "{search_query}"
@@ -767,113 +1568,106 @@ IMPORTANT: After typing the query, you MUST either:
 - Tap the search button (if visible)
 
 The task is only complete when search results for "{search_query}" are visible on the screen.
-"""
+""")
                     
                     # Check if we just typed the query and need to execute the search
-                    if hasattr(self, 'last_actions') and self.last_actions and self.last_actions[-1].get("action") == "type" and search_query.lower() in self.last_actions[-1].get("text", "").lower():
-                        user_prompt += """
+                    if hasattr(self, 'last_actions') and self.last_actions and self.last_actions[-1].get("action") == "type" and search_query in self.last_actions[-1].get("text", "").lower():
+                        prompt_parts.append("""
 NEXT STEP: You just typed the search query. Now you need to execute the search by either:
 1. Tapping on a search suggestion (preferred if visible)
 2. Pressing the enter/search key (use action "press_enter")
 3. Tapping the search button (if visible)
 
 DO NOT mark the task as complete until search results are visible.
-"""
+""")
             
             # Add information about the current iteration and previous actions
             if hasattr(self, 'current_iteration') and hasattr(self, 'last_actions'):
-                user_prompt += f"\nCurrent Iteration: {self.current_iteration}/15\n"
+                prompt_parts.append(f"\nCurrent Iteration: {self.current_iteration}/15\n")
                 
                 if self.last_actions:
-                    user_prompt += "Previous Actions:\n"
-                    for i, action in enumerate(self.last_actions[-3:]):  # Show last 3 actions
-                        user_prompt += f"Action {i+1}: {action.get('action', 'unknown')}"
+                    recent_actions = list(self.last_actions)[-3:]  # Show last 3 actions
+                    prompt_parts.append("Previous Actions:\n")
+                    for i, action in enumerate(recent_actions):
+                        prompt_parts.append(f"Action {i+1}: {action.get('action', 'unknown')}")
                         if action.get('action') == 'tap':
-                            user_prompt += f" at ({action.get('x_percent', 0):.1f}%, {action.get('y_percent', 0):.1f}%)"
+                            prompt_parts.append(f" at ({action.get('x_percent', 0):.1f}%, {action.get('y_percent', 0):.1f}%)")
                             if action.get('element_text'):
-                                user_prompt += f" on element with text: \"{action.get('element_text')}\""
+                                prompt_parts.append(f" on element with text: \"{action.get('element_text')}\"")
                             elif action.get('element_content_desc'):
-                                user_prompt += f" on element with desc: \"{action.get('element_content_desc')}\""
+                                prompt_parts.append(f" on element with desc: \"{action.get('element_content_desc')}\"")
                             elif action.get('element_resource_id'):
-                                user_prompt += f" on element with id: \"{action.get('element_resource_id')}\""
+                                prompt_parts.append(f" on element with id: \"{action.get('element_resource_id')}\"")
                         elif action.get('action') == 'type':
-                            user_prompt += f" text: \"{action.get('text', '')}\""
+                            prompt_parts.append(f" text: \"{action.get('text', '')}\"")
                         elif action.get('action') in ['scroll', 'swipe']:
-                            user_prompt += f" direction: {action.get('direction', 'unknown')}"
-                        user_prompt += f" - {action.get('reasoning', 'No reasoning')[:50]}...\n"
+                            prompt_parts.append(f" direction: {action.get('direction', 'unknown')}")
+                        prompt_parts.append(f" - {action.get('reasoning', 'No reasoning')[:50]}...\n")
                     
                     # If we've been repeating the same action, suggest trying a different approach
                     if len(self.last_actions) >= 3:
-                        same_action = all(a.get('action') == self.last_actions[0].get('action') for a in self.last_actions[-3:])
+                        same_action = all(a.get('action') == self.last_actions[0].get('action') for a in recent_actions)
                         if same_action:
-                            user_prompt += "\nNOTE: The same action has been repeated multiple times without success. Consider trying a different approach or position.\n"
+                            prompt_parts.append("\nNOTE: The same action has been repeated multiple times without success. Consider trying a different approach or position.\n")
                             
                             # Add specific suggestions based on the repeated action
                             if self.last_actions[0].get('action') == 'tap':
-                                user_prompt += """
+                                prompt_parts.append("""
 Suggestions for breaking the tap loop:
 1. Try tapping at different positions (e.g., if trying to tap a menu button in the top-right, try slightly different coordinates)
 2. Try scrolling to reveal more UI elements
 3. Try a different action like pressing back or going to the home screen
 4. If trying to tap a menu button, try different corners of the screen
-"""
+""")
                             elif self.last_actions[0].get('action') == 'scroll':
-                                user_prompt += """
+                                prompt_parts.append("""
 Suggestions for breaking the scroll loop:
 1. Try tapping in the center of the screen
 2. Try scrolling in a different direction
 3. Try a different action like pressing back or going to the home screen
-"""
+""")
             
-            user_prompt += "\nDetermine the NEXT SINGLE ACTION to take to progress toward completing the task."
+            prompt_parts.append("\nDetermine the NEXT SINGLE ACTION to take to progress toward completing the task.")
+            user_prompt = "".join(prompt_parts)
             
             # Make API call
-            planning_kwargs = {
-                "model": self.planning_model,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "max_tokens": 800
-            }
-            
-            # Add response_format for OpenAI
-            if self.llm_provider == "openai":
-                planning_kwargs["response_format"] = {"type": "json_object"}
-            
-            response = self.openai_client.chat.completions.create(**planning_kwargs)
-            response_text = response.choices[0].message.content
+            # Screenshot attached by get_screen_context for a vision-capable planning model
+            user_content = user_prompt
+            if screen_context.get("screen_images"):
+                image_parts, crop_note = screen_context["screen_images"]
+                note = "\nThe UI hierarchy had too little text, so a screenshot of the screen is attached."
+                if crop_note:
+                    note += f" {crop_note}"
+                user_content = [{"type": "text", "text": user_prompt + note}] + image_parts
+            
+            response_text = await self._stream_json_reply(
+                **self.planning_kwargs,
+                messages=[
+                    DETERMINE_ACTION_SYSTEM_MESSAGE,
+                    {"role": "user", "content": user_content}
+                ]
+            )
             
             # Debug: Print raw response
             print(f"Raw response: {response_text[:100]}...")  # Print first 100 chars
 
-            try:
-                action_plan = json.loads(response_text)
-                print("Successfully parsed JSON directly")
-            except json.JSONDecodeError:
-                # Try to extract JSON from text
-                json_match = re.search(r'(\{.*\})', response_text, re.DOTALL)
-                if json_match:
-                    try:
-                        action_plan = json.loads(json_match.group(1))
-                    except:
-                        action_plan = self._extract_action_from_text(response_text)
-                else:
-                    action_plan = self._extract_action_from_text(response_text)
-            
-            # Ensure numeric values and validate ranges
-            for key in ["x_percent", "y_percent", "wait_time"]:
-                if key in action_plan and isinstance(action_plan[key], str):
-                    try:
-                        action_plan[key] = float(action_plan[key])
-                    except:
-                        action_plan[key] = 50 if key in ["x_percent", "y_percent"] else 1
-            
-            # Ensure percentages are within valid range (0-100)
-            if "x_percent" in action_plan:
-                action_plan["x_percent"] = min(max(float(action_plan["x_percent"]), 0), 100)
-            if "y_percent" in action_plan:
-                action_plan["y_percent"] = min(max(float(action_plan["y_percent"]), 0), 100)
+            action_plan = _parse_json_response(response_text)
+            if isinstance(action_plan, dict):
+                # JSON numbers are already numbers; only convert values the model sent as something else
+                for key, default in (("x_percent", 50), ("y_percent", 50), ("wait_time", 1)):
+                    if key in action_plan and not isinstance(action_plan[key], (int, float)):
+                        try:
+                            action_plan[key] = float(action_plan[key])
+                        except (TypeError, ValueError):
+                            action_plan[key] = default
+                
+                # Ensure percentages are within valid range (0-100)
+                for key in ("x_percent", "y_percent"):
+                    if key in action_plan:
+                        action_plan[key] = min(max(action_plan[key], 0), 100)
+            else:
+                # The text fallback converts and clamps its values as it extracts them
+                action_plan = self._extract_action_from_text(response_text)
             
             # Print the action plan
             print(f"Action: {action_plan.get('action', 'unknown')}")
@@ -916,87 +1710,60 @@ Suggestions for breaking the scroll loop:
             "reasoning": "Extracted from text"
         }
         
-        # Extract action type
-        action_match = re.search(r'action["\s:]+([a-z_]+)', text, re.IGNORECASE)
-        if action_match:
-            action_plan["action"] = action_match.group(1).lower()
+        # Collect the first value given for each field in a single pass over the text
+        fields = {}
+        for match in _ACTION_FIELD_RE.finditer(text):
+            name, text_value, other_name, quoted, bare = match.groups()
+            key = (name or other_name).lower()
+            if key not in fields:
+                fields[key] = text_value if name else (quoted if quoted is not None else bare)
         
-        # Extract coordinates
-        x_match = re.search(r'x_percent["\s:]+(\d+(?:\.\d+)?)', text, re.IGNORECASE)
-        if x_match:
-            try:
-                x_percent = float(x_match.group(1))
-                # Ensure value is within 0-100 range
-                action_plan["x_percent"] = min(max(x_percent, 0), 100)
-            except ValueError:
-                action_plan["x_percent"] = 50
+        if fields.get("action"):
+            action_plan["action"] = fields["action"].lower()
         
-        y_match = re.search(r'y_percent["\s:]+(\d+(?:\.\d+)?)', text, re.IGNORECASE)
-        if y_match:
-            try:
-                y_percent = float(y_match.group(1))
-                # Ensure value is within 0-100 range
-                action_plan["y_percent"] = min(max(y_percent, 0), 100)
-            except ValueError:
-                action_plan["y_percent"] = 50
-        
-        # Extract element information
-        element_text_match = re.search(r'element_text["\s:]+["\']([^"\']+)["\']', text, re.IGNORECASE)
-        if element_text_match:
-            action_plan["element_text"] = element_text_match.group(1)
-        
-        element_desc_match = re.search(r'element_content_desc["\s:]+["\']([^"\']+)["\']', text, re.IGNORECASE)
-        if element_desc_match:
-            action_plan["element_content_desc"] = element_desc_match.group(1)
-        
-        element_id_match = re.search(r'element_resource_id["\s:]+["\']([^"\']+)["\']', text, re.IGNORECASE)
-        if element_id_match:
-            action_plan["element_resource_id"] = element_id_match.group(1)
-        
-        # Extract text for typing
-        text_match = re.search(r'text["\s:]+["\']([^"\']+)["\']', text, re.IGNORECASE)
-        if text_match:
-            action_plan["text"] = text_match.group(1)
-        
-        # Extract direction
-        direction_match = re.search(r'direction["\s:]+["\']?([a-z]+)["\']?', text, re.IGNORECASE)
-        if direction_match:
-            action_plan["direction"] = direction_match.group(1).lower()
-        
-        # Extract wait time
-        wait_match = re.search(r'wait_time["\s:]+(\d+(?:\.\d+)?)', text, re.IGNORECASE)
-        if wait_match:
+        # Coordinates, kept within the 0-100 range
+        for key in ("x_percent", "y_percent"):
+            if key in fields:
+                try:
+                    action_plan[key] = min(max(float(fields[key]), 0), 100)
+                except ValueError:
+                    action_plan[key] = 50
+        
+        # Element information
+        for key in ("element_text", "element_content_desc", "element_resource_id"):
+            if fields.get(key):
+                action_plan[key] = fields[key]
+        
+        # Text for typing
+        if fields.get("text"):
+            action_plan["text"] = fields["text"]
+        
+        if fields.get("direction"):
+            action_plan["direction"] = fields["direction"].lower()
+        
+        if "wait_time" in fields:
             try:
-                action_plan["wait_time"] = float(wait_match.group(1))
+                action_plan["wait_time"] = float(fields["wait_time"])
             except ValueError:
                 action_plan["wait_time"] = 1
         
-        # Extract task completion
-        complete_match = re.search(r'is_task_complete["\s:]+([a-z]+)', text, re.IGNORECASE)
-        if complete_match:
-            action_plan["is_task_complete"] = complete_match.group(1).lower() == "true"
+        if "is_task_complete" in fields:
+            action_plan["is_task_complete"] = fields["is_task_complete"].lower() == "true"
         
         return action_plan
     
     async def execute_action(self, action):
         """Execute the specified action on the device using element-based interactions."""
         action_type = action.get("action", "").lower()
+        self.allow_similar_screens = action_type not in ("tap", "type", "press_enter")
         
         try:
-            # Handle navigation actions with ADB (these are fine to keep)
-            if action_type == "go_home" or action_type == "home":
-                print("🏠 Going to home screen")
-                subprocess.run(["adb", "shell", "input", "keyevent", "KEYCODE_HOME"])
-                return True
-            
-            elif action_type == "press_back" or action_type == "back":
-                print("⬅️ Pressing back button")
-                subprocess.run(["adb", "shell", "input", "keyevent", "KEYCODE_BACK"])
-                return True
-            
-            elif action_type == "press_enter":
-                print("⌨️ Pressing Enter key")
-                subprocess.run(["adb", "shell", "input", "keyevent", "KEYCODE_ENTER"])
+            # Handle navigation actions with ADB, over the persistent shell
+            keyevent = _KEYEVENT_ACTIONS.get(action_type)
+            if keyevent:
+                message, keycode = keyevent
+                print(message)
+                await self._adb_shell_command(f"input keyevent {keycode}")
                 return True
             
             # For tap actions, ONLY use element-based interactions
@@ -1015,6 +1782,10 @@ Suggestions for breaking the scroll loop:
                 text = action.get("text", "")
                 print(f"⌨️ Typing text: \"{text}\"")
                 
+                # Without Appium, type into the focused field with adb
+                if not self.appium_driver:
+                    return await self._adb_type_text(text, action.get("press_enter", False))
+                
                 # Find an input field
                 input_field = None
                 try:
@@ -1091,6 +1862,18 @@ Suggestions for breaking the scroll loop:
             print(f"Error executing action: {e}")
             return False
     
+    async def _adb_type_text(self, text, press_enter=False):
+        """Type text into the focused field with `adb input`, pressing enter after it if asked.
+        
+        Typing, the pause and the enter key are sent as one shell command, so they cost a single
+        adb round-trip; the pause runs on the device.
+        """
+        # shlex.quote covers shell specials (&, quotes, parentheses) for the device shell
+        commands = [f"input text {shlex.quote(text.translate(_ADB_INPUT_TEXT_TRANS))}"]
+        if press_enter:
+            commands += ["sleep 0.5", "input keyevent KEYCODE_ENTER"]
+        return await self._adb_shell_command(" && ".join(commands)) is not None
+    
     def find_element_safely(self, action):
         """Find an element using multiple strategies."""
         try:
@@ -1140,32 +1923,73 @@ Suggestions for breaking the scroll loop:
             return None
     
     async def handle_specific_task(self, task):
-        """Placeholder for specific task handling - always returns None to use general approach."""
-        return None
+        """Handle single-step tasks (key presses, tapping a labelled element) straight from the UI hierarchy.
+        
+        Returns (True, None) if the task was completed. Otherwise returns (None, screen context), where
+        the context is the one fetched while looking for the element (None if none was), so the general
+        LLM-driven approach can start from it instead of fetching it again.
+        """
+        task_clean = task.strip().rstrip('.').strip()
+        
+        key_action = _DIRECT_KEY_TASKS.get(task_clean.lower())
+        if key_action:
+            return (True, None) if await self.execute_action({"action": key_action}) else (None, None)
+        
+        tap_match = _DIRECT_TAP_RE.match(task_clean)
+        if not tap_match:
+            return None, None
+        
+        label = tap_match.group(1).strip().lower()
+        if len(label.split()) > _DIRECT_TAP_MAX_WORDS or _NOT_A_TAP_LABEL_RE.search(label):
+            return None, None
+        
+        # Only tap directly if the hierarchy has an element with exactly this label
+        screen_context = await self.get_screen_context(task)
+        for elem in screen_context["ui_elements"]:
+            if elem.get("text", "").strip().lower() == label:
+                action = {"action": "tap", "element_text": elem["text"]}
+            elif elem.get("content_desc", "").strip().lower() == label:
+                action = {"action": "tap", "element_content_desc": elem["content_desc"]}
+            else:
+                continue
+            
+            print(f"⚡ Found '{tap_match.group(1)}' in the UI hierarchy, tapping it directly")
+            return (True, None) if await self.execute_action(action) else (None, None)
+        
+        return None, screen_context
     
     async def verify_search_results(self, query, screen_context):
         """Verify that search results for the given query are displayed."""
+        # Without any screen text, the planning model judged completion from the attached screenshot itself
+        if screen_context.get("screen_images") and not screen_context["screen_text"]:
+            return True
+        
+        # Lowercase the query and screen text once for all the checks below
+        query_lower = query.lower()
+        screen_text_lower = screen_context["screen_text"].lower()
+        
         # Check if the query appears in the screen text
-        if query.lower() in screen_context["screen_text"].lower():
+        if query_lower in screen_text_lower:
             return True
         
         # Check if any UI elements contain the query
         for elem in screen_context["ui_elements"]:
-            if query.lower() in elem.get("text", "").lower() or query.lower() in elem.get("content_desc", "").lower():
-                return True
-        
-        # Check for common search result indicators
-        search_indicators = ["results", "search", "found", "showing", "related"]
-        for indicator in search_indicators:
-            if indicator in screen_context["screen_text"].lower():
+            if query_lower in elem.get("text", "").lower() or query_lower in elem.get("content_desc", "").lower():
                 return True
         
-        return False
+        # Check for common search result indicators, all in one scan
+        return _SEARCH_RESULTS_RE.search(screen_text_lower) is not None
     
     async def run_task(self, task):
         """Run a task on the Android device."""
         print(f"\n🤖 Running task: {task}")
         
+        # Simple one-step tasks don't need the LLM at all
+        completed, early_context = await self.handle_specific_task(task)
+        if completed:
+            print(f"✅ Task completed: {task}")
+            return True
+        
         # Analyze if we need to launch an app
         task_analysis = await self.analyze_task(task)
         
@@ -1175,6 +1999,7 @@ Suggestions for breaking the scroll loop:
             print(f"📱 Task requires launching {app_name}")
             
             launch_success = await self.launch_app(app_name)
+            early_context = None  # The app launch may have changed the screen
             
             if launch_success:
                 print(f"✅ Successfully launched {app_name}")
@@ -1190,33 +2015,51 @@ Suggestions for breaking the scroll loop:
             else:
                 print(f"❌ Failed to launch {app_name}")
         
+        # For search tasks, completion is only accepted once results for the query are on screen
+        search_match = _SEARCH_QUERY_RE.search(task)
+        search_query = search_match.group(1).lower() if search_match else None
+        
         # Initialize tracking variables
-        self.last_actions = []
+        self.last_actions = deque(maxlen=5)  # Keep only the last 5 actions
         last_action = None
+        last_action_key = None
         repetitive_count = 0
+        last_frame_digest = None
+        unchanged_waits = 0
         
         # Main task execution loop
         for iteration in range(15):
             self.current_iteration = iteration + 1
             print(f"\n📱 Iteration {self.current_iteration}/15")
             
-            # Get screen context
-            screen_context = await self.get_screen_context()
+            # Get screen context (the first iteration may already have it from handle_specific_task)
+            if early_context is not None:
+                screen_context, early_context = early_context, None
+            else:
+                screen_context = await self.get_screen_context(task)
+            
+            # If we just waited and the screen hasn't changed at all, it's still loading;
+            # wait again instead of paying for another LLM call (a few times at most)
+            frame_digest = screen_context.get("frame_digest")
+            if (frame_digest is not None and frame_digest == last_frame_digest
+                    and last_action == "wait" and unchanged_waits < 3):
+                unchanged_waits += 1
+                print("⏳ Screen unchanged since the last wait, waiting again")
+                await self.execute_action({"action": "wait", "wait_time": 1})
+                continue
+            unchanged_waits = 0
+            last_frame_digest = frame_digest
             
             # Determine next action
             action_plan = await self.determine_action(task, screen_context)
             
             # Store action for future reference
             self.last_actions.append(action_plan)
-            if len(self.last_actions) > 5:  # Keep only the last 5 actions
-                self.last_actions.pop(0)
             
             # Check if task is complete
             if action_plan.get("is_task_complete", False):
                 # For search tasks, verify that the search was actually executed
-                if "search" in task.lower():
-                    # Extract the search query from the task
-                    search_query = task.lower().split("search")[1].strip()
+                if search_query:
                     if action_plan.get("action") == "type":
                         print("⚠️ Search task requires executing the search, not just typing the query")
                         action_plan["is_task_complete"] = False
@@ -1235,9 +2078,10 @@ Suggestions for breaking the scroll loop:
                     print(f"✅ Task completed: {task}")
                     return True
             
-            # Check for repetitive actions
+            # Check for repetitive actions (the same action on the same target)
             action = action_plan.get("action", "")
-            if action == last_action:
+            action_key = self._action_key(action_plan)
+            if action_key == last_action_key:
                 repetitive_count += 1
                 print(f"⚠️ Repetitive action: {action} (count: {repetitive_count})")
                 
@@ -1258,14 +2102,37 @@ Suggestions for breaking the scroll loop:
             else:
                 repetitive_count = 0
                 last_action = action
+                last_action_key = action_key
             
-            # Execute action
+            # Execute action; a wait action has already given the UI time to settle
             await self.execute_action(action_plan)
-            await asyncio.sleep(1)
+            if action != "wait":
+                await self._wait_for_stable_screen(1.0, stable_frames=1)
         
         print(f"⚠️ Reached maximum iterations without completing task")
         return False
     
+    def _action_key(self, action_plan):
+        """Identify an action by its type and target, for spotting the same action being repeated."""
+        action = action_plan.get("action", "")
+        key_builder = _ACTION_KEY_BUILDERS.get(action)
+        return key_builder(action_plan) if key_builder else (action,)
+    
+    def _format_element(self, i, element):
+        """Format a UI element as one numbered line for the interactive session."""
+        line = f"{i+1}. "
+        if element.get("text"):
+            line += f"Text: '{element.get('text')}' "
+        if element.get("content_desc"):
+            line += f"Desc: '{element.get('content_desc')}' "
+        if element.get("resource_id"):
+            line += f"ID: '{element.get('resource_id')}' "
+        if "center_x_percent" in element and "center_y_percent" in element:
+            line += f"Position: ({element['center_x_percent']}%, {element['center_y_percent']}%)"
+        if "source" in element:
+            line += f" Source: {element['source']}"
+        return line
+    
     async def interactive_session(self):
         """Start an interactive session with the Android device."""
         print("\n===== Android Agent =====")
@@ -1283,15 +2150,24 @@ Suggestions for breaking the scroll loop:
         # Start scrcpy
         await self.start_scrcpy()
         
+        # Fetch the installed package list while the user types the first task, so launching an
+        # app that isn't in APP_PACKAGES doesn't have to wait for it
+        warmup_task = asyncio.create_task(self._get_installed_packages())
+        self.background_tasks.add(warmup_task)
+        warmup_task.add_done_callback(self.background_tasks.discard)
+        
         while True:
-            user_input = input("\nEnter task or command: ")
+            user_input = await _ainput("\nEnter task or command: ")
+            command = user_input.lower()  # Lowercased once for all the command checks below
             
-            if user_input.lower() == 'exit':
+            if command == 'exit':
                 self.stop_scrcpy()
+                self._close_adb_shell()
+                await self.http_client.aclose()
                 print("Session ended.")
                 break
                 
-            elif user_input.lower() == 'help':
+            elif command == 'help':
                 print("\nCommands:")
                 print("  exit - End session")
                 print("  help - Show commands")
@@ -1308,41 +2184,32 @@ Suggestions for breaking the scroll loop:
                     print("  connect-appium - Try to connect to Appium server")
                     print("  appium-elements - List all UI elements from Appium")
             
-            elif user_input.lower() == 'context':
+            elif command == 'context':
                 context = await self.get_screen_context()
                 print("\n=== SCREEN ANALYSIS ===")
                 print(f"App: {context['app_info'].get('app_name', 'Unknown')}")
                 print(f"Package: {context['app_info'].get('package', 'Unknown')}")
                 print("\n--- UI ELEMENTS ---")
-                for i, element in enumerate(context.get('ui_elements', [])[:10]):
-                    print(f"{i+1}. ", end="")
-                    if element.get("text"):
-                        print(f"Text: '{element.get('text')}' ", end="")
-                    if element.get("content_desc"):
-                        print(f"Desc: '{element.get('content_desc')}' ", end="")
-                    if element.get("resource_id"):
-                        print(f"ID: '{element.get('resource_id')}' ", end="")
-                    if "center_x_percent" in element and "center_y_percent" in element:
-                        print(f"Position: ({element['center_x_percent']}%, {element['center_y_percent']}%)", end="")
-                    if "source" in element:
-                        print(f" Source: {element['source']}", end="")
-                    print()
-            
-            elif user_input.lower() == 'screenshot':
+                print("\n".join(self._format_element(i, element) for i, element in enumerate(context.get('ui_elements', [])[:10])))
+            
+            elif command == 'screenshot':
                 screenshot_path = await self.capture_screen()
-                print(f"Screenshot saved to {screenshot_path}")
+                if screenshot_path:
+                    print(f"Screenshot saved to {screenshot_path}")
+                else:
+                    print("❌ Failed to capture screenshot")
                 
-            elif user_input.lower().startswith('launch '):
+            elif command.startswith('launch '):
                 app_name = user_input[7:].strip()
                 await self.launch_app(app_name)
                 
-            elif user_input.lower() == 'home':
+            elif command == 'home':
                 await self.execute_action({"action": "go_home"})
                 
-            elif user_input.lower() == 'back':
+            elif command == 'back':
                 await self.execute_action({"action": "press_back"})
                 
-            elif user_input.lower() == 'appium-status' and APPIUM_AVAILABLE:
+            elif command == 'appium-status' and APPIUM_AVAILABLE:
                 if hasattr(self, 'appium_driver') and self.appium_driver:
                     try:
                         # Check if driver is still active
@@ -1357,7 +2224,7 @@ Suggestions for breaking the scroll loop:
                     print("❌ Appium is not connected")
                     print("   Use 'connect-appium' to connect")
                 
-            elif user_input.lower() == 'connect-appium' and APPIUM_AVAILABLE:
+            elif command == 'connect-appium' and APPIUM_AVAILABLE:
                 print("Attempting to connect to Appium...")
                 # Close existing connection if any
                 if hasattr(self, 'appium_driver') and self.appium_driver:
@@ -1372,9 +2239,9 @@ Suggestions for breaking the scroll loop:
                 try:
                     # Try both Appium 1.x and 2.0 status endpoints
                     try:
-                        response = requests.get('http://localhost:4723/status', timeout=5)
+                        response = await self.http_client.get('http://localhost:4723/status', timeout=5)
                     except:
-                        response = requests.get('http://localhost:4723/wd/hub/status', timeout=5)
+                        response = await self.http_client.get('http://localhost:4723/wd/hub/status', timeout=5)
                         
                     if response.status_code == 200:
                         print("✅ Appium server is running.")
@@ -1403,23 +2270,12 @@ Suggestions for breaking the scroll loop:
                     print("   Make sure Appium server is running and device is connected.")
                     print("   Start Appium with: appium")
             
-            elif user_input.lower() == 'appium-elements' and APPIUM_AVAILABLE:
+            elif command == 'appium-elements' and APPIUM_AVAILABLE:
                 if hasattr(self, 'appium_driver') and self.appium_driver:
                     elements = await self.get_appium_ui_elements()
                     print(f"\nFound {len(elements)} UI elements from Appium:")
-                    for i, element in enumerate(elements[:15]):  # Limit to 15 elements
-                        print(f"{i+1}. ", end="")
-                        if element.get("text"):
-                            print(f"Text: '{element.get('text')}' ", end="")
-                        if element.get("content_desc"):
-                            print(f"Desc: '{element.get('content_desc')}' ", end="")
-                        if element.get("resource_id"):
-                            print(f"ID: '{element.get('resource_id')}' ", end="")
-                        if "center_x_percent" in element and "center_y_percent" in element:
-                            print(f"Position: ({element['center_x_percent']}%, {element['center_y_percent']}%)", end="")
-                        if "source" in element:
-                            print(f" Source: {element['source']}", end="")
-                        print()
+                    # Limit to 15 elements
+                    print("\n".join(self._format_element(i, element) for i, element in enumerate(elements[:15])))
                 else:
                     print("❌ Appium is not connected")
                     print("   Use 'connect-appium' to connect")
@@ -1440,7 +2296,7 @@ async def main():
     print("1. OpenAI (requires OPENAI_API_KEY)")
     print("2. OpenRouter (requires OPENROUTER_API_KEY)")
     
-    provider_choice = input("Enter choice (1/2): ").strip()
+    provider_choice = (await _ainput("Enter choice (1/2): ")).strip()
     provider = "openai" if provider_choice == "1" else "openrouter"
     
     # Create agent and start session
@@ -4,12 +4,175 @@ import subprocess
 import time
 import json
 import re
-import uiautomator2 as u2
 import xml.etree.ElementTree as ET
+import shelve
+import uiautomator2 as u2
 from bs4 import BeautifulSoup
 import hashlib
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
+from console_input import ainput as _ainput
+from json_response import (
+    json_decoder as _json_decoder,
+    json_dumps_compact as _json_dumps_compact,
+    parse_json_response as _parse_json_response,
+)
+from scrcpy_output import wait_for_scrcpy
+
+# HTTP/2 support in httpx needs the optional h2 package
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _parse_streamed_steps(text, pos):
+    """Parse the step objects that have fully arrived in a partially streamed multi-step plan.
+
+    pos is where the previous call stopped (0 before the step list has been seen).
+    Returns (new steps, pos to resume from).
+    """
+    steps = []
+    if pos == 0:
+        key = text.find('"multi_step_plan"')
+        start = text.find('[', key) if key >= 0 else -1
+        if start < 0:
+            return steps, 0
+        pos = start + 1
+    while True:
+        while pos < len(text) and text[pos] in ' \t\r\n,':
+            pos += 1
+        if pos >= len(text) or text[pos] != '{':
+            return steps, pos
+        try:
+            step, pos_end = _json_decoder.raw_decode(text, pos)
+        except ValueError:
+            # The step is still arriving
+            return steps, pos
+        steps.append(step)
+        pos = pos_end
+
+
+async def _run_command(*args):
+    """Run a command without blocking the event loop and return its stdout as text."""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    output, _ = await process.communicate()
+    return output.decode('utf-8', errors='replace')
+
+
+# Plan several steps per call; each step carries an expected_text hint that run_task
+# checks locally, so the plan is only re-made when a hint fails
+MAX_STEPS_TO_PLAN = 5
+
+# System prompts (and their messages) are fixed, so build them once rather than on every call
+MULTI_STEP_SYSTEM_PROMPT = f"""
+You are an expert Android automation assistant that can precisely control a device by analyzing UI XML hierarchies.
+
+Your task is to:
+1. Analyze the UI hierarchy representation of the current Android screen
+2. Plan the next {MAX_STEPS_TO_PLAN} actions to complete the user's task efficiently
+3. Be specific about each action with exact element identifiers
+
+IMPORTANT: Instead of using x,y coordinates, ALWAYS use element identifiers when possible.
+This ensures precise interaction with the right UI elements.
+
+The available actions are:
+- "click_element": Click a specific UI element using one of these identifiers (in order of preference):
+  * resourceId (best and most reliable)
+  * text (good if exact text match)
+  * content-desc (good for accessibility elements)
+  * class + index (if nothing else works)
+
+- "input_text": Type text into a field (first click the field, then input)
+
+- "scroll": Scroll in a direction (up, down, left, right)
+
+- "back": Press the back button
+
+- "wait": Wait for a specific condition
+
+For repetitive actions like scrolling multiple times, combine them into a single action with a count.
+
+Return ONLY valid JSON in this format:
+```json
+{{
+  "current_screen": "Identify what screen user is on",
+  "multi_step_plan": [
+    {{
+      "action": {{
+        "type": "click_element | input_text | scroll | back | wait",
+        "target": {{
+          "method": "resourceId | text | content-desc | class",
+          "value": "The exact identifier from the UI hierarchy",
+          "fallback_index": 0 (the element's i value when method is class)
+        }},
+        "text": "Text to input if action is input_text",
+        "direction": "up | down | left | right (for scroll action)",
+        "duration": 5 (seconds to wait if action is wait),
+        "repeat_count": 1 (number of times to repeat this action, default 1)
+      }},
+      "description": "Human-readable description of this step",
+      "expected_outcome": "What should happen after this action",
+      "expected_text": "Short text or content-desc that will be visible once this step succeeds (empty if unsure)"
+    }}
+    // ... more steps up to {MAX_STEPS_TO_PLAN}
+  ],
+  "reasoning": "Detailed explanation of this plan",
+  "is_task_complete": false,
+  "requires_verification_after": true/false (whether to check UI after executing)
+}}
+```
+
+Plan as many of the next steps as you can predict with confidence. The steps are executed
+without looking at the UI again, except that expected_text is checked after each step and
+the remaining steps are dropped if it is not on screen.
+
+Only set is_task_complete to true when the entire task is finished.
+If requires_verification_after is true, UI will be checked after executing the steps.
+For scrolling or repetitive actions, set requires_verification_after to true after multiple steps.
+
+Always use element identifiers from the UI hierarchy, not made-up ones.
+"""
+MULTI_STEP_SYSTEM_MESSAGE = {"role": "system", "content": MULTI_STEP_SYSTEM_PROMPT}
+
+# Fixed settings for the multi-step planning request
+MULTI_STEP_REQUEST_KWARGS = {
+    "model": "gpt-4o-mini",  # Using GPT-4o-mini for efficiency
+    "response_format": {"type": "json_object"},
+    "max_tokens": 1200,  # A full plan of MAX_STEPS_TO_PLAN steps is well under this
+    "temperature": 0.2  # Lower temperature for more deterministic responses
+}
+
+TASK_PLANNING_SYSTEM_PROMPT = """
+You are an expert at planning Android automation tasks. Your job is to analyze a user's request and break it down into executable steps.
+
+For each task, determine:
+1. If it involves launching a specific app
+2. What steps should be taken after the app is launched
+3. Whether any parts can be executed directly without UI analysis
+
+Return ONLY valid JSON in this format:
+{
+  "analysis": "Brief analysis of what the task involves",
+  "has_app_launch": true/false,
+  "app_name": "Name of the app to launch (only if has_app_launch is true)",
+  "requires_ui_analysis_after_launch": true/false,
+  "post_launch_steps": "Description of what needs to be done after app launch",
+  "pure_ui_analysis_task": "Full task description if no direct actions possible"
+}
+"""
+TASK_PLANNING_SYSTEM_MESSAGE = {"role": "system", "content": TASK_PLANNING_SYSTEM_PROMPT}
+
+# Apps named as where to do a task, e.g. "search for cats on youtube" or "message bob using whatsapp";
+# only a phrase that ends the task counts, so "tap on settings icon" doesn't name an app
+_APP_IN_TASK_RE = re.compile(r'\b(?:on|in|using|via)\s+(?:the\s+)?(\w+(?:\s+\w+)?)\s*$')
+
+# Verbs whose "on"/"in" phrase is the thing acted on, not the app to use ("tap on camera", "turn on wifi")
+_ACT_ON_VERBS = frozenset(("tap", "click", "press", "turn", "switch", "toggle"))
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,13 +182,27 @@ class AndroidVisionAgent:
         """Initialize the Android Vision Agent."""
         self.device = None
         self.scrcpy_process = None
-        self.openai_client = OpenAI()
+        self.scrcpy_drain_task = None
+        # One pooled HTTP client for all LLM calls, so connections (and TLS sessions)
+        # are kept alive between planning cycles instead of being set up per request; the async
+        # client lets UI work (and scrcpy's output draining) carry on while a request is in flight
+        self.http_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            timeout=httpx.Timeout(120.0, connect=10.0)
+        )
+        self.openai_client = AsyncOpenAI(http_client=self.http_client)
         self.last_action_time = 0
         self.action_count = 0
         self.width = 0
         self.height = 0
-        self.ui_hash_cache = {}  # Cache for UI hashes -> actions
+        self.ui_hash_cache = {}  # Cache for (task, UI hash) keys -> multi-step plans, and task keys -> task plans
         self.last_ui_hash = None
+        self.last_plan_key = None
+        
+        # Plans are also kept on disk so reruns of the same task skip re-planning screens they've seen
+        self.plan_cache_path = os.environ.get("AGENT_PLAN_CACHE", ".agent_cache")
+        self.plan_store = None
         
         # Common package names for direct app launching
         self.common_packages = {
@@ -86,8 +263,8 @@ class AndroidVisionAgent:
         """Connect to an Android device."""
         try:
             # Try to get devices from adb
-            result = subprocess.run(['adb', 'devices'], capture_output=True, text=True)
-            lines = result.stdout.strip().split('\n')
+            devices_output = await _run_command('adb', 'devices')
+            lines = devices_output.strip().split('\n')
             if len(lines) <= 1:
                 print("No devices found. Make sure your device is connected and USB debugging is enabled.")
                 return False
@@ -136,14 +313,16 @@ class AndroidVisionAgent:
         try:
             print("Starting scrcpy...")
             # Use basic command without options that might not be supported
-            cmd = "scrcpy"
-            self.scrcpy_process = subprocess.Popen(cmd, shell=True)
-            await asyncio.sleep(2)
-            if self.scrcpy_process.poll() is None:
+            self.scrcpy_process = await asyncio.create_subprocess_exec(
+                "scrcpy", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+            )
+            self.scrcpy_drain_task = await wait_for_scrcpy(self.scrcpy_process, timeout=10)
+            if self.scrcpy_drain_task:
                 print("scrcpy started successfully")
                 return True
             else:
                 print("Failed to start scrcpy. Check if scrcpy is installed correctly.")
+                self.stop_scrcpy()
                 return False
         except Exception as e:
             print(f"Error starting scrcpy: {e}")
@@ -151,9 +330,13 @@ class AndroidVisionAgent:
     
     def stop_scrcpy(self):
         """Stop the scrcpy process."""
+        if self.scrcpy_drain_task:
+            self.scrcpy_drain_task.cancel()
+            self.scrcpy_drain_task = None
         if self.scrcpy_process:
             print("Stopping scrcpy...")
-            self.scrcpy_process.terminate()
+            if self.scrcpy_process.returncode is None:
+                self.scrcpy_process.terminate()
             self.scrcpy_process = None
     
     def parse_task(self, task):
@@ -182,6 +365,20 @@ class AndroidVisionAgent:
         # If we get here, this requires XML analysis
         return None
 
+    def _app_named_in_task(self, task):
+        """Return the known app a task says to use (e.g. "... on youtube"), or None."""
+        task_lower = task.lower()
+        match = _APP_IN_TASK_RE.search(task_lower)
+        if not match:
+            return None
+        preceding = task_lower[:match.start()].split()
+        if preceding and preceding[-1] in _ACT_ON_VERBS:
+            return None
+        app_name = match.group(1)
+        if app_name.endswith(" app"):
+            app_name = app_name[:-len(" app")]
+        return app_name if app_name in self.common_packages else None
+
     def get_ui_hierarchy_xml(self):
         """Get complete XML representation of current UI using direct API methods."""
         try:
@@ -307,6 +504,47 @@ class AndroidVisionAgent:
             print(f"Error preprocessing XML: {e}")
             return xml_content  # Return original if processing fails
     
+    def compact_hierarchy(self, xml_content):
+        """Reduce the XML hierarchy to a compact JSON list of the elements the LLM can act on.
+        
+        Each element keeps only what click_element/input_text selectors need: id (resourceId), text,
+        desc (content-desc), class, i (index among nodes of that class, for class selectors),
+        b (bounds as [left, top, right, bottom]) and c (clickable). This is several times fewer
+        tokens than the XML.
+        """
+        root = ET.fromstring(xml_content)
+        class_counts = {}
+        elements = []
+        for node in root.iter('node'):
+            cls = node.get('class', '')
+            index = class_counts.get(cls, 0)
+            class_counts[cls] = index + 1
+            
+            text = node.get('text', '')
+            desc = node.get('content-desc', '')
+            resource_id = node.get('resource-id', '')
+            clickable = node.get('clickable') == 'true'
+            if not (text or desc or resource_id or clickable or 'EditText' in cls):
+                continue
+            
+            element = {}
+            if resource_id:
+                element["id"] = resource_id
+            if text:
+                element["text"] = text if len(text) <= 50 else text[:50] + "..."
+            if desc:
+                element["desc"] = desc
+            element["class"] = cls
+            element["i"] = index
+            bounds = re.match(r'\[(\d+),(\d+)\]\[(\d+),(\d+)\]', node.get('bounds', ''))
+            if bounds:
+                element["b"] = [int(v) for v in bounds.groups()]
+            if clickable:
+                element["c"] = True
+            elements.append(element)
+        
+        return "[\n" + ",\n".join(_json_dumps_compact(e) for e in elements) + "\n]"
+    
     def extract_ui_metadata(self, xml_content):
         """Extract metadata about the UI from XML for better LLM understanding."""
         try:
@@ -363,8 +601,12 @@ class AndroidVisionAgent:
                 "screen_dimensions": {"width": 0, "height": 0}
             }
     
-    async def analyze_ui_with_multi_step_planning(self, xml_content, task, context=None):
-        """Have LLM analyze XML hierarchy and plan multiple steps."""
+    async def analyze_ui_with_multi_step_planning(self, xml_content, task, context=None, on_step=None):
+        """Have LLM analyze XML hierarchy and plan multiple steps.
+        
+        If on_step is given, the plan is streamed and on_step is awaited with each step as soon as
+        it has been generated; it returns False to stop the plan early.
+        """
         if not xml_content:
             print("No XML content to analyze")
             return None
@@ -373,9 +615,11 @@ class AndroidVisionAgent:
             # Compute hash of UI to detect if we've seen this state before
             ui_hash = self.compute_ui_hash(xml_content)
             
-            # Check if we've seen this UI state before
-            if ui_hash and ui_hash in self.ui_hash_cache:
-                cached_plan = self.ui_hash_cache[ui_hash]
+            # Check if we've planned this task on this UI state before (in this run or a previous one)
+            plan_key = self._plan_cache_key(task, ui_hash) if ui_hash else None
+            self.last_plan_key = plan_key
+            cached_plan = self._get_cached_plan(plan_key) if plan_key else None
+            if cached_plan:
                 print("⚡ Using cached multi-step plan for similar UI state")
                 return cached_plan
             
@@ -390,8 +634,12 @@ class AndroidVisionAgent:
             # Extract metadata to help the LLM understand the UI
             metadata = self.extract_ui_metadata(xml_content)
             
-            # Preprocess XML to make it more digestible for the LLM
-            processed_xml = self.preprocess_xml(xml_content)
+            # Send a compact element list rather than the XML; fall back to trimmed XML if it can't be parsed
+            try:
+                ui_description = "UI ELEMENTS (JSON, one per line; id=resourceId, desc=content-desc, i=index among elements of that class, b=bounds [left,top,right,bottom], c=clickable):\n" + self.compact_hierarchy(xml_content)
+            except Exception as e:
+                print(f"Error compacting UI hierarchy: {e}")
+                ui_description = f"UI HIERARCHY XML:\n```xml\n{self.preprocess_xml(xml_content)}\n```"
             
             # Create context description for the LLM
             context_info = ""
@@ -400,75 +648,6 @@ class AndroidVisionAgent:
                 for i, action in enumerate(context["previous_actions"]):
                     context_info += f"{i+1}. {action['description']}\n"
             
-            # Determine how many steps to plan based on complexity
-            max_steps_to_plan = 3
-            if "scroll" in task.lower():
-                max_steps_to_plan = 5  # More steps for scrolling tasks
-                
-            system_prompt = f"""
-            You are an expert Android automation assistant that can precisely control a device by analyzing UI XML hierarchies.
-            
-            Your task is to:
-            1. Analyze the XML hierarchy representation of the current Android screen
-            2. Plan the next {max_steps_to_plan} actions to complete the user's task efficiently
-            3. Be specific about each action with exact element identifiers
-            
-            IMPORTANT: Instead of using x,y coordinates, ALWAYS use element identifiers when possible.
-            This ensures precise interaction with the right UI elements.
-            
-            The available actions are:
-            - "click_element": Click a specific UI element using one of these identifiers (in order of preference):
-              * resourceId (best and most reliable)
-              * text (good if exact text match)
-              * content-desc (good for accessibility elements)
-              * class + index (if nothing else works)
-            
-            - "input_text": Type text into a field (first click the field, then input)
-            
-            - "scroll": Scroll in a direction (up, down, left, right)
-            
-            - "back": Press the back button
-            
-            - "wait": Wait for a specific condition
-            
-            For repetitive actions like scrolling multiple times, combine them into a single action with a count.
-            
-            Return ONLY valid JSON in this format:
-            ```json
-            {{
-              "current_screen": "Identify what screen user is on",
-              "multi_step_plan": [
-                {{
-                  "action": {{
-                    "type": "click_element | input_text | scroll | back | wait",
-                    "target": {{
-                      "method": "resourceId | text | content-desc | class",
-                      "value": "The exact identifier from the XML",
-                      "fallback_index": 0 
-                    }},
-                    "text": "Text to input if action is input_text",
-                    "direction": "up | down | left | right (for scroll action)",
-                    "duration": 5 (seconds to wait if action is wait),
-                    "repeat_count": 1 (number of times to repeat this action, default 1)
-                  }},
-                  "description": "Human-readable description of this step",
-                  "expected_outcome": "What should happen after this action"
-                }}
-                // ... more steps up to {max_steps_to_plan}
-              ],
-              "reasoning": "Detailed explanation of this plan",
-              "is_task_complete": false,
-              "requires_verification_after": true/false (whether to check UI after executing)
-            }}
-            ```
-            
-            Only set is_task_complete to true when the entire task is finished.
-            If requires_verification_after is true, UI will be checked after executing the steps.
-            For scrolling or repetitive actions, set requires_verification_after to true after multiple steps.
-            
-            Always use element identifiers from the XML, not made-up ones.
-            """
-            
             user_prompt = f"""
             TASK: {task}
             
@@ -476,33 +655,36 @@ class AndroidVisionAgent:
             
             CURRENT APP: {metadata["current_app_name"]} ({metadata["current_app"]})
             
-            UI HIERARCHY XML:
-            ```xml
-            {processed_xml}
-            ```
+            {ui_description}
             
-            Based on this XML representation of the current UI, plan the next {max_steps_to_plan} actions to take.
+            Based on this representation of the current UI, plan the next {MAX_STEPS_TO_PLAN} actions to take.
             """
             
+            messages = [
+                MULTI_STEP_SYSTEM_MESSAGE,
+                {"role": "user", "content": user_prompt}
+            ]
+            
             # Call the OpenAI API with gpt-4o-mini (more efficient for XML analysis)
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",  # Using GPT-4o-mini for efficiency
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=2000,
-                temperature=0.2  # Lower temperature for more deterministic responses
-            )
+            if on_step is None:
+                multi_step_plan = await self._call_planning_json(**MULTI_STEP_REQUEST_KWARGS, messages=messages)
+            else:
+                response_text, streamed_steps, stopped = await self._stream_plan(messages, on_step)
+                if stopped:
+                    # The plan went off course part way through; don't cache it
+                    return {"multi_step_plan": streamed_steps, "is_task_complete": False, "requires_verification_after": True}
+                multi_step_plan = _parse_json_response(response_text)
             
-            # Parse the response
-            multi_step_plan = json.loads(response.choices[0].message.content)
+            if not isinstance(multi_step_plan, dict):
+                print("LLM response did not contain a JSON plan")
+                if on_step is not None and streamed_steps:
+                    return {"multi_step_plan": streamed_steps, "is_task_complete": False, "requires_verification_after": True}
+                return None
             print(f"Multi-step plan: {json.dumps(multi_step_plan, indent=2)}")
             
             # Cache this plan for this UI state
             if ui_hash:
-                self.ui_hash_cache[ui_hash] = multi_step_plan
+                self._cache_plan(plan_key, multi_step_plan)
                 self.last_ui_hash = ui_hash
             
             return multi_step_plan
@@ -510,6 +692,97 @@ class AndroidVisionAgent:
             print(f"Error analyzing UI with LLM: {e}")
             return None
 
+    async def _call_planning_json(self, **request):
+        """Make a planning request and parse the JSON object in its reply (None if there isn't one)."""
+        response = await self.openai_client.chat.completions.create(**request)
+        if response.choices[0].finish_reason == "length":
+            print(f"⚠️ Planning response was cut off at max_tokens={request.get('max_tokens')}")
+        return _parse_json_response(response.choices[0].message.content)
+    
+    async def _stream_plan(self, messages, on_step):
+        """Stream a multi-step plan, awaiting on_step with each step as soon as it is complete.
+        
+        Returns (response text, steps handed to on_step, whether on_step stopped the plan).
+        """
+        stream = await self.openai_client.chat.completions.create(
+            **MULTI_STEP_REQUEST_KWARGS,
+            messages=messages,
+            stream=True
+        )
+        chunks = []
+        text = ""
+        pos = 0
+        steps = []
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                chunks.append(delta)
+                # Only re-parse once something may have closed
+                if "}" not in delta and pos:
+                    continue
+                text = "".join(chunks)
+                new_steps, pos = _parse_streamed_steps(text, pos)
+                for step in new_steps:
+                    steps.append(step)
+                    if await on_step(step) is False:
+                        return text, steps, True
+        finally:
+            await stream.close()
+        return "".join(chunks), steps, False
+    
+    def _plan_cache_key(self, task, ui_hash):
+        """Key a multi-step plan by the task and the UI state it was planned on."""
+        return hashlib.sha256(f"{task.strip().lower()}\0{ui_hash}".encode()).hexdigest()
+    
+    def _task_plan_key(self, task, model):
+        """Key a task breakdown by the model and the task, ignoring case and spacing."""
+        return hashlib.sha256(f"task-plan\0{model}\0{' '.join(task.lower().split())}".encode()).hexdigest()
+    
+    def _open_plan_store(self):
+        """Open the on-disk plan cache, disabling persistence if it can't be opened."""
+        if self.plan_store is None and self.plan_cache_path:
+            try:
+                self.plan_store = shelve.open(self.plan_cache_path)
+            except Exception as e:
+                print(f"Error opening plan cache {self.plan_cache_path}: {e}")
+                self.plan_cache_path = None
+        return self.plan_store
+    
+    def _get_cached_plan(self, plan_key):
+        """Return the cached plan for a key from memory or disk, or None."""
+        plan = self.ui_hash_cache.get(plan_key)
+        if plan is None:
+            store = self._open_plan_store()
+            if store is not None:
+                plan = store.get(plan_key)
+                if plan is not None:
+                    self.ui_hash_cache[plan_key] = plan
+        return plan
+    
+    def _cache_plan(self, plan_key, plan):
+        """Remember a plan in memory and on disk."""
+        self.ui_hash_cache[plan_key] = plan
+        store = self._open_plan_store()
+        if store is not None:
+            store[plan_key] = plan
+    
+    def _forget_plan(self, plan_key):
+        """Drop a plan that turned out not to work."""
+        self.ui_hash_cache.pop(plan_key, None)
+        store = self._open_plan_store()
+        if store is not None and plan_key in store:
+            del store[plan_key]
+    
+    def close_plan_store(self):
+        """Flush and close the on-disk plan cache."""
+        if self.plan_store is not None:
+            self.plan_store.close()
+            self.plan_store = None
+    
     async def execute_ui_action(self, action_data):
         """Execute action based on LLM guidance using element selectors instead of coordinates."""
         if not action_data or not isinstance(action_data, dict):
@@ -635,40 +908,52 @@ class AndroidVisionAgent:
             print(error_msg)
             return error_msg
     
+    def is_text_on_screen(self, text):
+        """Check whether text (or a matching content-desc) is currently visible on screen."""
+        try:
+            return self.device(textContains=text).exists or self.device(descriptionContains=text).exists
+        except Exception as e:
+            print(f"Error checking for text on screen: {e}")
+            return False
+    
+    def _plan_task_request(self, task):
+        """Build the chat completion request used to plan a task."""
+        
+        return {
+            "model": "gpt-3.5-turbo",  # Using a smaller model for speed
+            "messages": [
+                TASK_PLANNING_SYSTEM_MESSAGE,
+                {"role": "user", "content": f"Task: {task}"}
+            ],
+            "response_format": {"type": "json_object"},
+            "max_tokens": 300
+        }
+    
+    def _fallback_plan(self, task):
+        """Return a fallback plan that uses UI analysis for everything."""
+        return {
+            "analysis": "Failed to plan with LLM, using UI analysis",
+            "has_app_launch": False,
+            "requires_ui_analysis_after_launch": False,
+            "pure_ui_analysis_task": task
+        }
+    
     async def plan_task(self, task):
         """Use the LLM to break down the task into steps and determine if direct actions are possible."""
         try:
-            system_prompt = """
-            You are an expert at planning Android automation tasks. Your job is to analyze a user's request and break it down into executable steps.
-            
-            For each task, determine:
-            1. If it involves launching a specific app
-            2. What steps should be taken after the app is launched
-            3. Whether any parts can be executed directly without UI analysis
-            
-            Return ONLY valid JSON in this format:
-            {
-              "analysis": "Brief analysis of what the task involves",
-              "has_app_launch": true/false,
-              "app_name": "Name of the app to launch (only if has_app_launch is true)",
-              "requires_ui_analysis_after_launch": true/false,
-              "post_launch_steps": "Description of what needs to be done after app launch",
-              "pure_ui_analysis_task": "Full task description if no direct actions possible"
-            }
-            """
-            
-            response = self.openai_client.chat.completions.create(
-                model="gpt-3.5-turbo",  # Using a smaller model for speed
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Task: {task}"}
-                ],
-                response_format={"type": "json_object"},
-                max_tokens=500
-            )
+            request = self._plan_task_request(task)
             
-            # Parse the response
-            plan = json.loads(response.choices[0].message.content)
+            # The breakdown only depends on the task wording, so reuse it for tasks we've planned before
+            plan_key = self._task_plan_key(task, request["model"])
+            plan = self._get_cached_plan(plan_key)
+            if plan is not None:
+                print("⚡ Using cached task plan")
+            else:
+                plan = await self._call_planning_json(**request)
+                if not isinstance(plan, dict):
+                    print("LLM response did not contain a JSON task plan")
+                    return self._fallback_plan(task)
+                self._cache_plan(plan_key, plan)
             print("📋 Task Plan:")
             for key, value in plan.items():
                 if key != "analysis":  # Show analysis at the end
@@ -678,13 +963,7 @@ class AndroidVisionAgent:
             return plan
         except Exception as e:
             print(f"Error planning task: {e}")
-            # Return a fallback plan that uses UI analysis for everything
-            return {
-                "analysis": "Failed to plan with LLM, using UI analysis",
-                "has_app_launch": False,
-                "requires_ui_analysis_after_launch": False,
-                "pure_ui_analysis_task": task
-            }
+            return self._fallback_plan(task)
     
     async def run_task(self, task):
         """Execute a task using LLM planning and UI-guided automation."""
@@ -711,9 +990,19 @@ class AndroidVisionAgent:
                 print(f"⚠️ Direct app launch failed: {e}")
         
         # If we haven't done a direct launch, or for the next steps, use LLM planning + XML
+        early_hierarchy = None
         if not direct_launch_success:
-            # Use LLM to plan the task
-            plan = await self.plan_task(task)
+            # Tasks that say which app to use don't need the LLM to work that out
+            app_in_task = self._app_named_in_task(task)
+            if app_in_task:
+                plan = {"analysis": f"Task names the {app_in_task} app", "has_app_launch": True, "app_name": app_in_task}
+            else:
+                # Dump the current screen in a worker thread while the LLM plans the task; unless
+                # the plan launches an app, it's the hierarchy the first planning cycle needs
+                early_hierarchy = asyncio.get_running_loop().run_in_executor(None, self.get_ui_hierarchy_xml)
+                
+                # Use LLM to plan the task
+                plan = await self.plan_task(task)
             
             # If plan indicates we can launch an app directly
             if plan.get("has_app_launch", False) and plan.get("app_name"):
@@ -724,6 +1013,10 @@ class AndroidVisionAgent:
                     package_name = self.common_packages[app_name]
                     
                     print(f"📱 Stage 1: Launching {app_name} ({package_name}) directly")
+                    if early_hierarchy is not None:
+                        # That dump shows the screen from before the launch; let it finish and drop it
+                        await early_hierarchy
+                        early_hierarchy = None
                     try:
                         self.device.app_start(package_name)
                         await asyncio.sleep(2)  # Wait for app to start
@@ -762,31 +1055,31 @@ class AndroidVisionAgent:
             try:
                 # Get UI hierarchy XML
                 print(f"\nPlanning cycle {planning_cycles}: Getting UI hierarchy...")
-                xml_content = self.get_ui_hierarchy_xml()
+                if early_hierarchy is not None:
+                    xml_content = await early_hierarchy
+                    early_hierarchy = None
+                else:
+                    xml_content = self.get_ui_hierarchy_xml()
                 
                 if not xml_content:
                     print("Failed to get UI hierarchy")
                     results.append("Failed to get UI hierarchy")
                     break
                 
-                # Analyze UI with LLM and get multi-step plan
-                print("Analyzing UI with LLM for multi-step planning...")
-                multi_step_plan = await self.analyze_ui_with_multi_step_planning(xml_content, task, context)
+                plan_interrupted = False
+                plan_stopped = False
+                steps_run = 0
                 
-                if not multi_step_plan:
-                    print("Failed to analyze UI")
-                    results.append("Failed to analyze UI")
-                    break
-                
-                # Execute each action in the multi-step plan
-                step_count = 0
-                for step in multi_step_plan.get("multi_step_plan", []):
-                    step_count += 1
+                async def run_step(step):
+                    """Execute one step of the plan; returns False once the rest of the plan should be dropped."""
+                    nonlocal total_steps_taken, plan_interrupted, plan_stopped, steps_run
+                    steps_run += 1
                     total_steps_taken += 1
                     
                     if total_steps_taken > max_total_steps:
                         print(f"Reached maximum total steps limit ({max_total_steps})")
-                        break
+                        plan_stopped = True
+                        return False
                     
                     print(f"\nStep {total_steps_taken}: {step.get('description', 'Executing action')}")
                     action_data = step.get("action", {})
@@ -800,11 +1093,39 @@ class AndroidVisionAgent:
                         "description": result
                     })
                     
-                    # Wait a bit after action to let UI update
-                    await asyncio.sleep(1)
+                    # Wait a bit after action to let UI update (unless the action was itself a wait)
+                    if action_data.get("type") != "wait":
+                        await asyncio.sleep(1)
+                    
+                    # Check the step's expected outcome locally instead of asking the LLM again;
+                    # if it didn't happen, drop the rest of the plan and re-plan from the current UI
+                    expected_text = step.get("expected_text")
+                    if expected_text and not self.is_text_on_screen(expected_text):
+                        print(f"⚠️ Expected '{expected_text}' on screen after this step, re-planning")
+                        plan_interrupted = plan_stopped = True
+                        # Don't replay a plan that just failed if we land on the same UI again
+                        if self.last_plan_key:
+                            self._forget_plan(self.last_plan_key)
+                        return False
+                    return True
+                
+                # Analyze UI with LLM and get multi-step plan; steps are executed as they stream in
+                print("Analyzing UI with LLM for multi-step planning...")
+                multi_step_plan = await self.analyze_ui_with_multi_step_planning(xml_content, task, context, on_step=run_step)
+                
+                if not multi_step_plan:
+                    print("Failed to analyze UI")
+                    results.append("Failed to analyze UI")
+                    break
+                
+                # Execute whatever wasn't already run while streaming (all of it for a cached plan)
+                if not plan_stopped:
+                    for step in multi_step_plan.get("multi_step_plan", [])[steps_run:]:
+                        if not await run_step(step):
+                            break
                 
-                # Check if task is complete
-                if multi_step_plan.get("is_task_complete", False):
+                # Check if task is complete (only if the whole plan went as expected)
+                if not plan_interrupted and multi_step_plan.get("is_task_complete", False):
                     print("Task marked as complete by the LLM")
                     task_complete = True
                     break
@@ -812,7 +1133,7 @@ class AndroidVisionAgent:
                 # Check if we need to verify after executing the plan
                 requires_verification = multi_step_plan.get("requires_verification_after", True)
                 
-                if not requires_verification and not task_complete:
+                if not requires_verification and not plan_interrupted:
                     # If no verification needed and more steps planned, execute them without checking UI again
                     continue
                 
@@ -848,7 +1169,7 @@ class AndroidVisionAgent:
             scrcpy_started = await self.start_scrcpy()
             if not scrcpy_started:
                 print("Warning: scrcpy failed to start. Continuing without screen mirroring.")
-                user_input = input("Do you want to continue without screen mirroring? (y/n): ")
+                user_input = await _ainput("Do you want to continue without screen mirroring? (y/n): ")
                 if user_input.lower() != 'y':
                     print("Exiting.")
                     return
@@ -856,9 +1177,8 @@ class AndroidVisionAgent:
             # Try to initialize UIAutomator2 at startup
             try:
                 print("\nAttempting to initialize UIAutomator2 services...")
-                init_result = subprocess.run(["python", "-m", "uiautomator2", "init"], 
-                              capture_output=True, text=True)
-                if "Success" in init_result.stdout:
+                init_output = await _run_command("python", "-m", "uiautomator2", "init")
+                if "Success" in init_output:
                     print("✅ UIAutomator2 initialization successful")
                 else:
                     print("⚠️ UIAutomator2 initialization may not have succeeded, but we'll continue")
@@ -868,7 +1188,7 @@ class AndroidVisionAgent:
             
             # Main interaction loop
             while True:
-                task = input("\nEnter task (or 'exit'): ")
+                task = await _ainput("\nEnter task (or 'exit'): ")
                 
                 if task.lower() in ["exit", "quit", "bye"]:
                     break
@@ -879,7 +1199,7 @@ class AndroidVisionAgent:
                 print("\n✅ Task completed!")
                 print(f"Result: {result}")
                 
-                feedback = input("\nDid that work? (y/n): ")
+                feedback = await _ainput("\nDid that work? (y/n): ")
                 if feedback.lower() == "n":
                     print("I'll try to do better next time.")
         
@@ -887,6 +1207,8 @@ class AndroidVisionAgent:
             print("\nSession interrupted.")
         finally:
             self.stop_scrcpy()
+            self.close_plan_store()
+            await self.http_client.aclose()
             print("Session ended.")
 
 async def main():
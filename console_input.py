@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sys
+import threading
+
+# Bytes read from stdin after the end of the last line returned (e.g. several lines piped at once)
+_pending = bytearray()
+
+
+def _read_line():
+    """Read one line from the stdin file descriptor, without its line ending.
+
+    os.read takes none of sys.stdin's locks, so a thread blocked here can't stop the interpreter
+    from shutting down (a daemon thread inside input() makes it abort instead).
+    """
+    fd = sys.stdin.fileno()
+    while b"\n" not in _pending:
+        chunk = os.read(fd, 4096)
+        if not chunk:
+            if not _pending:
+                raise EOFError("EOF when reading a line")
+            break
+        _pending.extend(chunk)
+    end = _pending.find(b"\n")
+    end = len(_pending) if end < 0 else end + 1
+    line = bytes(_pending[:end])
+    del _pending[:end]
+    return line.decode(sys.stdin.encoding or "utf-8", errors="replace").rstrip("\r\n")
+
+
+def _resolve(future, result=None, error=None):
+    """Settle future with a line read from stdin, unless it was cancelled meanwhile."""
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+async def ainput(prompt):
+    """Read a line from stdin without blocking the event loop, so scrcpy's output keeps draining.
+
+    The read runs on a daemon thread rather than the loop's default executor: asyncio.run() joins
+    executor threads on exit, so a Ctrl+C at the prompt would otherwise hang until Enter is pressed.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    print(prompt, end="", flush=True)
+
+    def read():
+        try:
+            line, error = _read_line(), None
+        except Exception as e:  # EOFError when stdin is closed
+            line, error = None, e
+        try:
+            loop.call_soon_threadsafe(_resolve, future, line, error)
+        except RuntimeError:
+            pass  # The loop has already closed; nobody is waiting for this line
+
+    threading.Thread(target=read, daemon=True).start()
+    return await future
@@ -0,0 +1,42 @@
+import json
+
+# Use orjson for parsing LLM responses and serializing prompt data if it's installed
+# (it's several times faster than json)
+try:
+    import orjson
+    json_loads = orjson.loads
+    
+    def json_dumps_compact(obj):
+        # orjson already writes compact, non-ASCII-escaped JSON (as bytes)
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_loads = json.loads
+    
+    def json_dumps_compact(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+# Decodes a JSON value starting at a given offset, ignoring whatever text follows it
+json_decoder = json.JSONDecoder()
+
+
+def parse_json_response(text):
+    """Parse a JSON object from a model response, tolerating ```json fences and surrounding prose.
+    
+    Returns None if no JSON object can be parsed.
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    # A bare object (the usual case) goes to the fast parser; with text around it that parse
+    # could only fail, so skip it
+    if not text[:start].strip() and text.rstrip().endswith("}"):
+        try:
+            return json_loads(text)
+        except ValueError:
+            pass
+    # Decode from the first "{" (inside a ```json fence or after some prose); raw_decode
+    # stops at the end of the object instead of scanning the rest of the text
+    try:
+        return json_decoder.raw_decode(text, start)[0]
+    except ValueError:
+        return None
@@ -0,0 +1,39 @@
+import asyncio
+
+# scrcpy log lines that mean mirroring/recording has actually started
+SCRCPY_READY_MARKERS = (b"INFO: Renderer:", b"INFO: Texture:", b"INFO: Recording started")
+
+
+async def drain_stream(stream):
+    """Discard everything written to a subprocess pipe."""
+    while await stream.readline():
+        pass
+
+
+async def wait_for_scrcpy(process, timeout):
+    """Read scrcpy's log until it reports it's ready, then keep draining it in the background.
+    
+    Returns the task draining the log, or None if scrcpy exited before it was ready.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            # No marker (older scrcpy versions log differently); trust it if it's still running
+            break
+        try:
+            line = await asyncio.wait_for(process.stdout.readline(), remaining)
+        except asyncio.TimeoutError:
+            break
+        if not line:
+            # scrcpy exited before it was ready
+            return None
+        if any(marker in line for marker in SCRCPY_READY_MARKERS):
+            break
+    
+    if process.returncode is not None:
+        return None
+    
+    # scrcpy blocks once the pipe buffer fills, so keep reading its output
+    return asyncio.ensure_future(drain_stream(process.stdout))
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import shutil
+import stat
+import struct
+import subprocess
+
+import pytest
+
+android_ai_agent = pytest.importorskip("android_ai_agent")
+
+# Stands in for adb: only `adb shell` with nothing after it starts a shell, reading commands from stdin
+FAKE_ADB = """#!/bin/sh
+if [ "$#" -ne 1 ] || [ "$1" != shell ]; then
+    echo "unexpected adb arguments: $*" >&2
+    exit 1
+fi
+exec sh
+"""
+
+
+def _shell_agent(adb_path):
+    """An AndroidAgent with only the persistent adb shell set up (no Appium or LLM client)."""
+    agent = android_ai_agent.AndroidAgent.__new__(android_ai_agent.AndroidAgent)
+    agent.adb_path = adb_path
+    agent.adb_shells = {}
+    agent.adb_shell_locks = {"main": asyncio.Lock(), "capture": asyncio.Lock()}
+    agent.adb_shell_failures = {"main": 0, "capture": 0}
+    return agent
+
+
+async def _close_shells(agent):
+    """Stop the agent's shells and reap them while the event loop is still running."""
+    shells = list(agent.adb_shells.values())
+    agent._close_adb_shell()
+    for shell in shells:
+        await shell.wait()
+
+
+def _device_attached():
+    if not shutil.which("adb"):
+        return False
+    try:
+        state = subprocess.run(["adb", "get-state"], capture_output=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    return state.returncode == 0 and state.stdout.strip() == b"device"
+
+
+@pytest.fixture
+def fake_adb(tmp_path):
+    path = tmp_path / "adb"
+    path.write_text(FAKE_ADB)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+
+def test_commands_round_trip_through_one_shell(fake_adb):
+    async def run():
+        agent = _shell_agent(fake_adb)
+        try:
+            first = await agent._run_in_adb_shell("echo hello", timeout=5)
+            pid = agent.adb_shells["main"].pid
+            second = await agent._run_in_adb_shell("printf 'a\\000\\377b'", timeout=5)
+            assert agent.adb_shells["main"].pid == pid
+            return first, second
+        finally:
+            await _close_shells(agent)
+
+    first, second = asyncio.run(run())
+    assert first == b"hello\n"
+    assert second == b"a\x00\xffb"
+
+
+def test_channels_use_separate_shells(fake_adb):
+    async def run():
+        agent = _shell_agent(fake_adb)
+        try:
+            outputs = await asyncio.gather(
+                agent._run_in_adb_shell("echo $$", timeout=5),
+                agent._run_in_adb_shell("echo $$", timeout=5, channel="capture"),
+            )
+            return outputs
+        finally:
+            await _close_shells(agent)
+
+    main_pid, capture_pid = asyncio.run(run())
+    assert main_pid and capture_pid and main_pid != capture_pid
+
+
+def test_failing_channel_leaves_the_other_on(fake_adb):
+    async def run():
+        agent = _shell_agent(fake_adb)
+        try:
+            # `read` waits for a line that never comes, so every call times out
+            for _ in range(3):
+                assert await agent._run_in_adb_shell("read line", timeout=0.1, channel="capture") is None
+            # The capture shell is off now, without trying to run the command
+            assert await agent._run_in_adb_shell("echo capture", channel="capture") is None
+            assert "capture" not in agent.adb_shells
+            return await agent._run_in_adb_shell("echo main", timeout=5)
+        finally:
+            await _close_shells(agent)
+
+    assert asyncio.run(run()) == b"main\n"
+
+
+@pytest.mark.skipif(not _device_attached(), reason="needs adb and an attached device")
+def test_round_trip_on_device():
+    async def run():
+        agent = _shell_agent("adb")
+        try:
+            echoed = await agent._run_in_adb_shell("echo hello")
+            frame = await agent._run_in_adb_shell("screencap")
+            return echoed, frame
+        finally:
+            await _close_shells(agent)
+
+    echoed, frame = asyncio.run(run())
+    assert echoed == b"hello\n"
+    # Raw screencap output has to come back byte for byte: a header, then 4 bytes per pixel
+    width, height, _ = struct.unpack_from("<III", frame)
+    assert len(frame) - width * height * 4 in (12, 16)
@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+android_ai_agent = pytest.importorskip("android_ai_agent")
+
+
+class _DirectTapAgent(android_ai_agent.AndroidAgent):
+    """An AndroidAgent with a fixed screen, recording the contexts fetched and the actions executed."""
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.contexts_fetched = 0
+        self.actions = []
+
+    async def get_screen_context(self, task=None):
+        self.contexts_fetched += 1
+        return {"app_info": {}, "ui_elements": self.elements, "screen_text": ""}
+
+    async def execute_action(self, action_plan):
+        self.actions.append(action_plan)
+        return True
+
+
+def _handle(agent, task):
+    return asyncio.run(agent.handle_specific_task(task))
+
+
+def test_taps_an_element_with_the_label():
+    agent = _DirectTapAgent([{"text": "Settings", "content_desc": ""}])
+    assert _handle(agent, "Tap the Settings button") == (True, None)
+    assert agent.actions == [{"action": "tap", "element_text": "Settings"}]
+
+
+def test_returns_the_context_when_no_element_matches():
+    agent = _DirectTapAgent([{"text": "Settings", "content_desc": ""}])
+    completed, context = _handle(agent, "tap Wi-Fi")
+    assert completed is None
+    assert context["ui_elements"] == agent.elements
+    assert agent.actions == []
+
+
+@pytest.mark.parametrize("task", [
+    "select all",
+    "select all photos and delete them",
+    "tap every photo",
+    "click send, then go back",
+    "press the big round button at the very bottom",
+])
+def test_skips_tasks_that_are_not_a_single_tap(task):
+    agent = _DirectTapAgent([{"text": "All", "content_desc": ""}, {"text": "Send", "content_desc": ""}])
+    assert _handle(agent, task) == (None, None)
+    assert agent.contexts_fetched == 0
+    assert agent.actions == []
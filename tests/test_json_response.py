@@ -0,0 +1,20 @@
+from json_response import json_dumps_compact, parse_json_response
+
+
+def test_parses_a_bare_object():
+    assert parse_json_response('{"action": "tap", "x_percent": 50}') == {"action": "tap", "x_percent": 50}
+
+
+def test_parses_an_object_in_a_fence_or_prose():
+    fenced = 'Here is the plan:\n```json\n{"action": "back"}\n```\nDone.'
+    assert parse_json_response(fenced) == {"action": "back"}
+    assert parse_json_response('I will tap it. {"action": "tap"} Then wait.') == {"action": "tap"}
+
+
+def test_returns_none_without_an_object():
+    assert parse_json_response("no json here") is None
+    assert parse_json_response('{"action": ') is None
+
+
+def test_dumps_compact_unescaped_json():
+    assert json_dumps_compact({"text": "café", "n": [1, 2]}) == '{"text":"café","n":[1,2]}'
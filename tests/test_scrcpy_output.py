@@ -0,0 +1,35 @@
+import asyncio
+import sys
+
+from scrcpy_output import wait_for_scrcpy
+
+
+async def _start(script):
+    return await asyncio.create_subprocess_exec(
+        sys.executable, "-c", script, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+
+
+def test_ready_once_the_marker_is_logged():
+    async def run():
+        process = await _start(
+            "import time; print('INFO: scrcpy 2.4'); print('INFO: Recording started', flush=True); time.sleep(30)"
+        )
+        try:
+            drain_task = await wait_for_scrcpy(process, timeout=10)
+            assert drain_task is not None and not drain_task.done()
+            drain_task.cancel()
+        finally:
+            process.kill()
+            await process.wait()
+
+    asyncio.run(run())
+
+
+def test_not_ready_if_scrcpy_exits_first():
+    async def run():
+        process = await _start("print('ERROR: Could not find any ADB device')")
+        assert await wait_for_scrcpy(process, timeout=10) is None
+        await process.wait()
+
+    asyncio.run(run())